@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+########################################################################################################
+# See README.md file
+#
+# Reproducible benchmark for adstxt_crawler.py. Starts a local stand-in ads.txt server (like the Go one in
+# fakeserver/) that answers for many loopback hosts, then runs the crawler end to end against synthetic
+# target lists and reports hosts/sec, records/sec, peak RSS and DB write time. No network access needed.
+#
+# Every synthetic host gets a deterministic behaviour picked from its index: a plain ads.txt of '--lines'
+# records, an HTTP 500, an HTML page, a response slower than the crawler's timeout, and optionally
+# subdomain=/contentproducerdomain= referrals to other synthetic hosts.
+#
+########################################################################################################
+
+import os
+import re
+import sys
+import time
+import zlib
+import random
+import sqlite3
+import tempfile
+import threading
+import subprocess
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CRAWLER = os.path.join(HERE, "adstxt_crawler.py")
+SCHEMA = os.path.join(HERE, "adstxt_crawler.sql")
+
+# exchanges listed in adstxt_crawler.sql, so the records pass validation
+EXCHANGES = (
+    "green_ssp.com",
+    "violet_ssp.com",
+    "grey_ssp.com",
+)
+
+SUMMARY_PATTERN = re.compile(r"^.*Wrote .*, db write ([0-9.]+)s", re.MULTILINE)
+
+#################################################################
+# FUNCTION host_name / host_index
+#  the i-th synthetic host is a distinct loopback address served
+#  on 'port' (the whole 127.0.0.0/8 block is loopback on Linux)
+#
+#################################################################
+
+
+def host_name(i, port):
+    return f"127.{i // 62500 % 250}.{i // 250 % 250}.{i % 250 + 1}:{port}"
+
+
+def host_index(host):
+    try:
+        a, b, c = (int(x) for x in host.split(":")[0].split(".")[1:])
+    except ValueError:
+        return -1
+    return a * 62500 + b * 250 + c - 1
+
+
+# end host_name / host_index  #####
+
+#################################################################
+# CLASS AdsTxtHandler
+#  serve the ads.txt of any synthetic host after 'latency' seconds,
+#  honouring If-None-Match like a regular web server
+#
+#################################################################
+
+
+class AdsTxtHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    num_hosts = 1
+    lines = 3
+    error_rate = 0.0
+    html_rate = 0.0
+    timeout_rate = 0.0
+    hang = 6.0
+    referral_rate = 0.0
+
+    def adstxt_body(self, i, rnd):
+        body = [f"#ads.txt for {self.headers.get('Host', '')}"]
+        for n in range(self.lines):
+            body.append(
+                f"{rnd.choice(EXCHANGES)},{i}{n:04d},"
+                f"{'DIRECT' if n % 3 else 'RESELLER'},{rnd.getrandbits(64):016x}"
+            )
+        if rnd.random() < self.referral_rate:
+            port = self.server.server_address[1]
+            body.append(f"subdomain={host_name((i * 7919 + 1) % self.num_hosts, port)}")
+            body.append(
+                "contentproducerdomain="
+                f"{host_name((i * 104729 + 7) % self.num_hosts, port)}"
+            )
+        return ("\n".join(body) + "\n").encode("utf-8")
+
+    def do_GET(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if self.path != "/ads.txt":
+            self.send_error(404)
+            return
+
+        i = host_index(self.headers.get("Host", ""))
+        rnd = random.Random(i)
+        roll = rnd.random()
+        if roll < self.error_rate:
+            self.send_error(500)
+            return
+        roll -= self.error_rate
+        if roll < self.timeout_rate:
+            time.sleep(self.hang)
+        roll -= self.timeout_rate
+        if 0 <= roll < self.html_rate:
+            body = b"<html><body><div>Not Found</div></body></html>"
+        else:
+            body = self.adstxt_body(i, rnd)
+
+        etag = '"%08x"' % zlib.crc32(body)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:  # the crawler gave up on a slow host
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+# end AdsTxtHandler  #####
+
+
+class AdsTxtServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+
+#################################################################
+# FUNCTION start_server
+#  run the stand-in server on all loopback addresses in a thread,
+#  'options' override AdsTxtHandler settings
+#
+#################################################################
+
+
+def start_server(port, latency, **options):
+    AdsTxtHandler.latency = latency
+    for name, value in options.items():
+        setattr(AdsTxtHandler, name, value)
+    server = AdsTxtServer(("", port), AdsTxtHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# end start_server  #####
+
+#################################################################
+# FUNCTION write_targets
+#  one distinct synthetic host per target line
+#
+#################################################################
+
+
+def write_targets(filename, num_hosts, port):
+    with open(filename, "w", encoding="utf-8") as f:
+        for i in range(num_hosts):
+            f.write(host_name(i, port) + "\n")
+
+
+# end write_targets  #####
+
+#################################################################
+# FUNCTION run_crawl
+#  crawl the targets into a fresh DB, return a dict with the wall
+#  time, the peak RSS of the crawler process, the records written
+#  and the DB write time the crawl returned, as printed on the
+#  final "Wrote ..." line of the crawler
+#
+#################################################################
+
+
+def run_crawl(workdir, targets, num_threads, crawler_args=()):
+    db_name = os.path.join(workdir, f"bench_{num_threads}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_name + suffix):
+            os.remove(db_name + suffix)
+    conn = sqlite3.connect(db_name)
+    with open(SCHEMA, encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.close()
+
+    cmd = [sys.executable, CRAWLER, "-t", targets, "-d", db_name, "-p", str(num_threads)]
+    cmd += list(crawler_args)
+    with open(os.path.join(workdir, "crawler.out"), "w+", encoding="utf-8") as out:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=workdir, stdout=out)
+        # wait4 gives the resource usage of this child alone
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        stdout = out.read()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout)
+
+    conn = sqlite3.connect(db_name)
+    records = conn.execute("SELECT count(*) FROM adstxt").fetchone()[0]
+    conn.close()
+
+    db_write = SUMMARY_PATTERN.findall(stdout)
+    return {
+        "seconds": seconds,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": rusage.ru_maxrss / 1024.0,
+        "records": records,
+        "db_write": float(db_write[-1]) if db_write else 0.0,
+    }
+
+
+# end run_crawl  #####
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument(
+        "-n", "--hosts", dest="num_hosts", default=[1000], type=int, nargs="+",
+        help="synthetic target list sizes to crawl, e.g. 1000 10000 250000",
+    )
+    arg_parser.add_argument(
+        "-l", "--latency", dest="latency", default=0.05, type=float,
+        help="seconds the server waits before answering",
+    )
+    arg_parser.add_argument(
+        "-p", "--thread_pool", dest="num_threads", default=[4, 64, 256], type=int,
+        nargs="+", help="crawler concurrency settings to compare",
+    )
+    arg_parser.add_argument(
+        "--lines", dest="lines", default=3, type=int,
+        help="records per ads.txt file",
+    )
+    arg_parser.add_argument(
+        "--error_rate", dest="error_rate", default=0.0, type=float,
+        help="fraction of hosts answering HTTP 500",
+    )
+    arg_parser.add_argument(
+        "--html_rate", dest="html_rate", default=0.0, type=float,
+        help="fraction of hosts serving an HTML page",
+    )
+    arg_parser.add_argument(
+        "--timeout_rate", dest="timeout_rate", default=0.0, type=float,
+        help="fraction of hosts answering only after --hang seconds",
+    )
+    arg_parser.add_argument(
+        "--hang", dest="hang", default=6.0, type=float,
+        help="seconds the slow hosts take, past the crawler timeout by default",
+    )
+    arg_parser.add_argument(
+        "--referral_rate", dest="referral_rate", default=0.0, type=float,
+        help="fraction of hosts referring to two other synthetic hosts",
+    )
+    arg_parser.add_argument(
+        "--crawler_args", dest="crawler_args", default="",
+        help="extra adstxt_crawler.py arguments, e.g. '--batch_size 20000'",
+    )
+    arg_parser.add_argument(
+        "--port", dest="port", default=8765, type=int, help="server port",
+    )
+    args = arg_parser.parse_args()
+
+    server = start_server(
+        args.port,
+        args.latency,
+        num_hosts=max(args.num_hosts),
+        lines=args.lines,
+        error_rate=args.error_rate,
+        html_rate=args.html_rate,
+        timeout_rate=args.timeout_rate,
+        hang=args.hang,
+        referral_rate=args.referral_rate,
+    )
+    print(
+        f"{'hosts':>7} {'-p':>5} {'seconds':>8} {'hosts/s':>9} {'records/s':>10} "
+        f"{'peak RSS':>9} {'db write':>9}"
+    )
+    with tempfile.TemporaryDirectory() as workdir:
+        for num_hosts in args.num_hosts:
+            targets = os.path.join(workdir, f"targets_{num_hosts}.txt")
+            write_targets(targets, num_hosts, args.port)
+
+            for num_threads in args.num_threads:
+                run = run_crawl(workdir, targets, num_threads, args.crawler_args.split())
+                print(
+                    f"{num_hosts:>7} {num_threads:>5} {run['seconds']:>8.2f} "
+                    f"{num_hosts / run['seconds']:>9.1f} "
+                    f"{run['records'] / run['seconds']:>10.1f} "
+                    f"{run['peak_rss_mb']:>7.1f}MB {run['db_write']:>8.2f}s"
+                )
+    server.shutdown()
@@ -59,326 +59,1772 @@ import csv
 import socket
 import sqlite3
 import logging
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from urllib.parse import urlparse  # Changed this import
-import requests
 import re
-import tempfile
-import multiprocessing
-from multiprocessing import Pool
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import hashlib
+import time
+import threading
+import functools
+import random
+import json
+import queue
+import asyncio
+import gzip
+import codecs
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
+from collections import namedtuple, deque, defaultdict, Counter
+from adstxt_parser import parse_lines
+from adstxt_validator import UNKNOWN_ADSYSTEM, validate_records
+from adstxt_storage import HISTORY_SEED, SITE_TABLES, SQLiteStorage, open_storage
+
+# tables added after the original adstxt_crawler.sql, created on
+# startup so that existing DBs keep working
+SCHEMA_UPGRADES = (
+    """CREATE TABLE IF NOT EXISTS crawl_state(
+           HOST                         TEXT    NOT NULL,
+           ETAG                         TEXT    NOT NULL DEFAULT '',
+           LAST_MODIFIED                TEXT    NOT NULL DEFAULT '',
+           CONTENT_HASH                 TEXT    NOT NULL DEFAULT '',
+           REFERRALS                    TEXT    NOT NULL DEFAULT '',
+           LAST_STATUS                  INTEGER NOT NULL DEFAULT (0),
+           UPDATED                      DATE    DEFAULT (datetime('now','utc')),
+        PRIMARY KEY (HOST)
+    );""",
+    """CREATE TABLE IF NOT EXISTS crawl_job(
+           JOB                          TEXT    NOT NULL,
+           HOST                         TEXT    NOT NULL,
+           LAST_STATUS                  INTEGER NOT NULL DEFAULT (0),
+           UPDATED                      DATE    DEFAULT (datetime('now','utc')),
+        PRIMARY KEY (JOB,HOST)
+    );""",
+    """CREATE TABLE IF NOT EXISTS dns_cache(
+           HOST                         TEXT    NOT NULL,
+           IP                           TEXT    NOT NULL DEFAULT '',
+           RESOLVED                     REAL    NOT NULL,
+        PRIMARY KEY (HOST)
+    );""",
+    """CREATE TABLE IF NOT EXISTS host_health(
+           HOST                         TEXT    NOT NULL,
+           FAILURES                     INTEGER NOT NULL DEFAULT (0),
+           LAST_SUCCESS                 REAL    NOT NULL DEFAULT (0),
+           LAST_ATTEMPT                 REAL    NOT NULL DEFAULT (0),
+           LATENCY                      REAL    NOT NULL DEFAULT (0),
+           LAST_ERROR                   TEXT    NOT NULL DEFAULT '',
+        PRIMARY KEY (HOST)
+    );""",
+    """CREATE TABLE IF NOT EXISTS raw_response(
+           HOST                         TEXT    NOT NULL,
+           CRAWLED                      REAL    NOT NULL,
+           CONTENT_HASH                 TEXT    NOT NULL,
+           STATUS                       INTEGER NOT NULL DEFAULT (0),
+           CHARSET                      TEXT    NOT NULL DEFAULT '',
+        PRIMARY KEY (HOST,CRAWLED)
+    );""",
+    "CREATE INDEX IF NOT EXISTS raw_response_hash ON raw_response (CONTENT_HASH);",
+    # seller lookups, see adstxt_query
+    "CREATE INDEX IF NOT EXISTS adstxt_exchange_seller ON adstxt (EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID);",
+    "CREATE INDEX IF NOT EXISTS adstxt_adsystem_seller ON adstxt (ADSYSTEM_DOMAIN, SELLER_ACCOUNT_ID);",
+    """CREATE TABLE IF NOT EXISTS adstxt_history(
+           SITE_DOMAIN                  TEXT    NOT NULL,
+           EXCHANGE_DOMAIN              TEXT    NOT NULL,
+           SELLER_ACCOUNT_ID            TEXT    NOT NULL,
+           ACCOUNT_TYPE                 TEXT    NOT NULL,
+           TAG_ID                       TEXT    NOT NULL,
+           FIRST_SEEN                   DATE    NOT NULL DEFAULT (datetime('now','utc')),
+           REMOVED                      DATE,
+        PRIMARY KEY (SITE_DOMAIN,EXCHANGE_DOMAIN,SELLER_ACCOUNT_ID,FIRST_SEEN)
+    );""",
+    "CREATE INDEX IF NOT EXISTS adstxt_history_first_seen ON adstxt_history (FIRST_SEEN);",
+    "CREATE INDEX IF NOT EXISTS adstxt_history_removed ON adstxt_history (REMOVED);",
+)
+
+# hostname with at least one dot, or an IPv4 address, and an optional port
+HOST_PATTERN = re.compile(
+    r"^(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?\.)+"
+    r"(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59}|[0-9]{1,3})(?::[0-9]{1,5})?$"
+)
+
+# outcome of one ads.txt download; 'text' is None unless a usable
+# file was served, status 0 means the request itself failed and
+# 'error' then says how ("timeout", "connection", ...). A body that
+# was served but dropped has its status and "html", "binary" or
+# "too_large" as 'error'. 'body' holds the bytes the text was
+# decoded from, as served, 'digest' their SHA-1 (the CONTENT_HASH of
+# crawl_state) and 'charset' the one named by the Content-Type.
+# the timings are in seconds: 'connect' is spent opening new
+# connections, 'ttfb' until the response headers and 'fetch' is the
+# whole download including redirects
+FetchResult = namedtuple(
+    "FetchResult",
+    "host status text etag last_modified size connect ttfb fetch error body digest charset",
+    defaults=(0, 0.0, 0.0, 0.0, "", None, "", ""),
+)
+
+# failures worth retrying in the same crawl, anything else (404, TLS
+# or redirect errors, HTML pages) will not change within seconds
+TRANSIENT_ERRORS = ("timeout", "connection")
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+# response bodies are read CHUNK_SIZE bytes at a time and dropped
+# past MAX_BODY_SIZE, so a fetch never holds more than that
+# whatever a host serves at /ads.txt
+CHUNK_SIZE = 16384
+MAX_BODY_SIZE = 4 * 1024 * 1024
+
+# Content-Types that cannot be an ads.txt file
+BINARY_TYPES = ("image/", "audio/", "video/", "font/", "application/pdf")
 
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+# WAL lets the parsers read adsystem_domain while the writer commits,
+# NORMAL only fsyncs at WAL checkpoints
+DEFAULT_PRAGMAS = ("journal_mode=WAL", "synchronous=NORMAL")
 
 #################################################################
-# FUNCTION process_adstxt_row_to_db.
-#  handle one row and push to the DB
+# FUNCTION db_writer
+#  the only DB writer of a crawl: drain the record queue until the
+#  None sentinel, committing every 'batch_size' rows or whenever the
+#  queue has been idle for 'flush_interval' seconds to 'storage'
+#  (see adstxt_storage), which is closed at the end. The running row
+#  count and commit time go to stats["records"] and
+#  stats["commit_seconds"], the rows of the batches that failed to
+#  commit to stats["dropped"], each commit duration to
+#  latencies["commit"].
 #
 #################################################################
 
 
-def process_adstxt_row_to_db(conn, data_row, comment, hostname, adsystem_id):
-    insert_stmt = "INSERT OR REPLACE INTO adstxt (SITE_DOMAIN, EXCHANGE_DOMAIN, ADSYSTEM_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE, TAG_ID, ENTRY_COMMENT) VALUES (?, ?, ?, ?, ?, ?, ? );"
-    exchange_host = ""
-    seller_account_id = ""
-    account_type = ""
-    tag_id = ""
+def db_writer(
+    storage,
+    record_queue,
+    batch_size=5000,
+    flush_interval=1.0,
+    stats=None,
+    latencies=None,
+):
+    batch = defaultdict(list)
+    pending = 0
     sql_rows = 0
+    done = False
+    # the storage may be reused across crawls
+    dropped = storage.dropped
 
-    if len(data_row) >= 3:
-        exchange_host = data_row[0].lower().strip()
-        seller_account_id = data_row[1].lower().strip()
-        account_type = data_row[2].lower().strip()
-
-    if len(data_row) == 4:
-        tag_id = data_row[3].lower().strip()
-
-    # data validation heuristics
-    data_valid = 1
-
-    # Minimum length of a domain name is 1 character, not including extensions.
-    if len(hostname) < 3:
-        data_valid = 0
-
-    if len(exchange_host) < 3:
-        data_valid = 0
-
-    if not isinstance(adsystem_id, int):
-        data_valid = 0
-
-    # could be single digit integers
-    if len(seller_account_id) < 1:
-        data_valid = 0
-
-    # ads.txt supports 'DIRECT' and 'RESELLER'
-    if account_type not in ["direct", "reseller"]:
-        data_valid = 0
-
-    if data_valid > 0:
-        logging.debug(
-            "%s | %s | %s | %s | %s | %s | %s"
-            % (
-                hostname,
-                exchange_host,
-                adsystem_id,
-                seller_account_id,
-                account_type,
-                tag_id,
-                comment,
-            )
+    while not done:
+        try:
+            item = record_queue.get(timeout=flush_interval)
+        except queue.Empty:
+            item = ()
+
+        if item is None:
+            done = True
+        elif item:
+            table, row = item
+            batch[table].append(row)
+            pending += len(row[1]) if table == "site" else 1
+
+        if pending >= batch_size or (pending and not item):
+            start = time.perf_counter()
+            sql_rows += storage.write(batch)
+            commit_seconds = time.perf_counter() - start
+            if latencies is not None:
+                latencies["commit"].append(commit_seconds)
+            if stats is not None:
+                stats["records"] = sql_rows
+                stats["commit_seconds"] = stats.get("commit_seconds", 0.0) + commit_seconds
+                stats["dropped"] = storage.dropped - dropped
+            logging.info(f"  committed {pending} rows")
+            batch = defaultdict(list)
+            pending = 0
+
+    storage.close()
+    return sql_rows
+
+
+# end db_writer  #####
+
+#################################################################
+# FUNCTION cached_resolver
+#  aiohttp resolver answering from 'dns_cache' {name: (ip, resolved_at)}
+#  (see resolve_targets), so the targets resolved before the crawl
+#  are not looked up a second time when their connection opens.
+#  Other names (redirects) go to the default aiohttp resolver.
+#
+#################################################################
+
+
+def cached_resolver(dns_cache):
+    from aiohttp.resolver import DefaultResolver
+
+    class CachedResolver(DefaultResolver):
+        async def resolve(self, host, port=0, family=socket.AF_INET):
+            cached = dns_cache.get(host.lower())
+            if cached and cached[0] and family in (socket.AF_INET, socket.AF_UNSPEC):
+                return [
+                    {
+                        "hostname": host,
+                        "host": cached[0],
+                        "port": port,
+                        "family": socket.AF_INET,
+                        "proto": 0,
+                        "flags": socket.AI_NUMERICHOST,
+                    }
+                ]
+            return await super().resolve(host, port, family)
+
+    return CachedResolver()
+
+
+# end cached_resolver  #####
+
+#################################################################
+# FUNCTION open_session.
+#  the aiohttp session shared by all the fetches of a crawl, to be
+#  closed by the caller. Its connection pool holds at most
+#  'concurrency' connections in use, idle ones are kept alive and
+#  reused for the redirects and referrals of the same hosts.
+#  The time spent opening new connections (DNS, TCP and TLS) is
+#  added to the "connect" entry of the trace_request_ctx dict a
+#  request is made with, see fetch_adstxt. aiohttp is only imported
+#  here, not by importing this module nor by --import, --replay or
+#  --merge.
+#
+#################################################################
+
+
+def open_session(concurrency=64, dns_cache=None):
+    import aiohttp
+
+    async def connect_started(session, ctx, params):
+        ctx.connect_started = time.perf_counter()
+
+    async def connect_ended(session, ctx, params):
+        ctx.trace_request_ctx["connect"] += time.perf_counter() - ctx.connect_started
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_start.append(connect_started)
+    trace.on_connection_create_end.append(connect_ended)
+
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=concurrency, resolver=cached_resolver(dns_cache or {})
+        ),
+        headers={
+            "User-Agent": "AdsTxtCrawler/1.0; +https://github.com/InteractiveAdvertisingBureau/adstxtcrawler",
+            "Accept": "text/plain",
+        },
+        trace_configs=[trace],
+    )
+
+
+# end open_session  #####
+
+#################################################################
+# FUNCTION looks_like_html.
+#  whether a served file is an HTML page (a soft 404, a login or
+#  parking page...) rather than an ads.txt file
+#
+#################################################################
+
+
+def looks_like_html(text):
+    text = text.lower()
+    return "html" in text or "body" in text or "div" in text or "span" in text
+
+
+# end looks_like_html  #####
+
+#################################################################
+# FUNCTION body_decoder.
+#  incremental decoder for a body served with 'charset', UTF-8 when
+#  it names none or one Python does not know
+#
+#################################################################
+
+
+def body_decoder(charset):
+    try:
+        decoder = codecs.getincrementaldecoder(charset or "utf-8")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")
+
+    return decoder("replace")
+
+
+# end body_decoder  #####
+
+#################################################################
+# FUNCTION read_adstxt_body.
+#  stream the body of an aiohttp response, decoding it chunk by
+#  chunk. The Content-Type and the first chunk decide whether it is
+#  binary data or an HTML page, and reading stops as soon as it is
+#  or once more than 'max_size' bytes came in.
+#  returns the text and the bytes it was decoded from (None when
+#  the body was dropped), the number of bytes read and "binary",
+#  "html", "too_large" or ""
+#
+#################################################################
+
+
+async def read_adstxt_body(r, max_size=MAX_BODY_SIZE):
+    content_type = r.headers.get("Content-Type", "").lower()
+    if content_type.startswith(BINARY_TYPES):
+        return None, None, 0, "binary"
+    length = r.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) > max_size:
+        return None, None, 0, "too_large"
+
+    # ads.txt files are UTF-8 unless the server names another charset
+    charset = r.charset
+    decoder = body_decoder(charset)
+
+    chunks = []
+    raw_chunks = []
+    size = 0
+    async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            return None, None, size, "too_large"
+        text = decoder.decode(chunk)
+        if not chunks:
+            if not charset and b"\0" in chunk:
+                return None, None, size, "binary"
+            if looks_like_html(text):
+                return None, None, size, "html"
+        chunks.append(text)
+        raw_chunks.append(chunk)
+    chunks.append(decoder.decode(b"", True))
+
+    return "".join(chunks), b"".join(raw_chunks), size, ""
+
+
+# end read_adstxt_body  #####
+
+#################################################################
+# FUNCTION fetch_adstxt.
+#  download the ads.txt file of one host with the aiohttp 'session'
+#  (see open_session). When the validators of the previous crawl
+#  are passed the request is conditional and an unchanged file
+#  comes back as a 304 without a body.
+#  'timeout' is in seconds, or a (connect, read) pair as returned
+#  by adaptive_timeout. The body is streamed, see read_adstxt_body.
+#
+#################################################################
+
+
+async def fetch_adstxt(
+    session,
+    ahost,
+    etag="",
+    last_modified="",
+    timeout=5,
+    max_size=MAX_BODY_SIZE,
+    max_redirects=5,
+):
+    import aiohttp
+
+    myheaders = {}
+    if etag:
+        myheaders["If-None-Match"] = etag
+    if last_modified:
+        myheaders["If-Modified-Since"] = last_modified
+
+    aurl = f"http://{ahost}/ads.txt"
+    logging.info(f" Crawling  {aurl} : {ahost} ")
+
+    connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    timing = {"connect": 0.0}
+    start = time.perf_counter()
+    text = None
+    body = None
+    status = 0
+    size = 0
+    ttfb = 0.0
+    error = ""
+    try:
+        async with session.get(
+            aurl,
+            headers=myheaders,
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=connect_timeout, sock_read=read_timeout
+            ),
+            max_redirects=max_redirects,
+            trace_request_ctx=timing,
+        ) as r:
+            status = r.status
+            ttfb = time.perf_counter() - start
+            logging.info(f"  {r.status}")
+            if r.status == 200:
+                text, body, size, error = await read_adstxt_body(r, max_size)
+            else:
+                # small error pages are drained so the connection is reused
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        break
+    except asyncio.TimeoutError:
+        error = "timeout"
+    except aiohttp.ClientSSLError:
+        error = "ssl"
+    except aiohttp.TooManyRedirects:
+        error = "redirects"
+    except aiohttp.ClientConnectionError:
+        error = "connection"
+    except Exception as e:
+        error = type(e).__name__
+    if error:
+        logging.info(f"  {error}")
+
+    fetch = time.perf_counter() - start
+    connect = timing["connect"]
+
+    if text is None:
+        return FetchResult(
+            ahost, status, None, etag, last_modified, size, connect, ttfb, fetch, error
         )
 
-        # Insert a row of data using bind variables (protect against SQL injection)
-        c = conn.cursor()
+    # non-printable characters are dropped line by line by the parser
+
+    logging.debug("-------------")
+    logging.debug(r.request_info.headers)
+    logging.debug("-------------")
+    logging.debug(f"{text}")
+    logging.debug("-------------")
+
+    return FetchResult(
+        ahost,
+        status,
+        text,
+        r.headers.get("ETag", ""),
+        r.headers.get("Last-Modified", ""),
+        size,
+        connect,
+        ttfb,
+        fetch,
+        body=body,
+        digest=hashlib.sha1(body).hexdigest(),
+        charset=r.charset or "",
+    )
+
+
+# end fetch_adstxt  #####
+
+#################################################################
+# FUNCTION parse_adstxt_to_db.
+#  parse the text of one ads.txt file, validate it in one batch (see
+#  adstxt_validator) and queue the rows on 'sink' for the DB writer.
+#  'adsystem_ids' is the mapping returned by the load_adsystem_ids
+#  of the storage backend.
+#  returns the number of rows queued, the referral domains and the
+#  rejected records
+#
+#################################################################
+
+
+def parse_adstxt_to_db(sink, adsystem_ids, ahost, text):
+    validated = validate_records(ahost, parse_lines(text.splitlines()), adsystem_ids)
+    for row in validated.rows:
+        sink.put(row)
+
+    unknown = {r.value for r in validated.rejections if r.reason == UNKNOWN_ADSYSTEM}
+    if unknown:
+        logging.warning(f"FIX unknown ADSYSTEM {sorted(unknown)} in {ahost}")
+    logging.debug(f"{ahost}: {len(validated.rows)} rows, rejected {validated.rejections}")
+
+    return len(validated.rows), validated.referrals, validated.rejections
+
+
+# end parse_adstxt_to_db  #####
+
+#################################################################
+# FUNCTION process_fetch_result.
+#  parse a fetched file unless the previous crawl already stored the
+#  same content, queue its rows as one "site" item replacing the
+#  stored content of the host (see write_site), and queue the new
+#  crawl_state row of the host. When the content changed, the
+#  crawl_state row travels inside the "site" item, so the new
+#  CONTENT_HASH is committed with the content or not at all.
+#  The file counts as unchanged when the 'digest' of the result,
+#  the SHA-1 of the bytes served, is the stored CONTENT_HASH.
+#  'state' is the host's entry from load_crawl_state, if any. A
+#  result whose etag and last_modified are None did not come from a
+#  live fetch (see import_adstxt_files): the stored validators are
+#  kept while its content matches the stored CONTENT_HASH. With
+#  'reparse' the file is parsed even when it is unchanged.
+#  returns the number of rows queued, the referral domains, whether
+#  the file was unchanged since the previous crawl and the rejected
+#  records
+#
+#################################################################
+
+
+def process_fetch_result(sink, adsystem_ids, result, state=None, reparse=False):
+    rowcnt = 0
+    rejections = []
+    unchanged = True
+    etag, last_modified, content_hash, referrals = state or ("", "", "", "")
+    referral_domains = referrals.split()
+    site_rows = None
+
+    if result.text is not None:
+        new_hash = result.digest
+        if result.etag is not None:
+            etag = result.etag
+            last_modified = result.last_modified
+        elif new_hash != content_hash:
+            # the stored validators describe other content
+            etag = last_modified = ""
+        if new_hash == content_hash and not reparse:
+            logging.info(f"  unchanged {result.host}")
+        else:
+            site_rows = RecordBuffer()
+            rowcnt, referral_domains, rejections = parse_adstxt_to_db(
+                site_rows, adsystem_ids, result.host, result.text
+            )
+            content_hash = new_hash
+            unchanged = False
+    elif result.status == 304:
+        logging.info(f"  not modified {result.host}")
+    else:
+        referral_domains = []
+        unchanged = False
+
+    state_row = (
+        result.host.lower(),
+        etag,
+        last_modified,
+        content_hash,
+        " ".join(referral_domains),
+        result.status,
+    )
+    if site_rows is None:
+        sink.put(("crawl_state", state_row))
+    else:
+        sink.put(("site", (result.host, site_rows, state_row)))
+
+    return rowcnt, referral_domains, unchanged, rejections
+
+
+# end process_fetch_result  #####
+
+#################################################################
+# FUNCTION adaptive_timeout
+#  (connect, read) timeouts for a host from its host_health entry:
+#  a few times its usual latency when it is known, and shorter and
+#  shorter while the host keeps failing, never above 'timeout' nor
+#  below 'min_timeout'
+#
+#################################################################
+
+
+def adaptive_timeout(health, timeout=5.0, min_timeout=1.0):
+    if not health:
+        return (timeout, timeout)
+
+    failures, latency = health[0], health[3]
+    read = latency * 4 if latency > 0 else timeout
+    if failures:
+        read = min(read, max(latency * 2, timeout / (failures + 1)))
+    read = min(timeout, max(min_timeout, read))
+    connect = min(read, max(min_timeout, latency * 2)) if latency > 0 else read
+
+    return (connect, read)
+
+
+# end adaptive_timeout  #####
+
+#################################################################
+# FUNCTION is_transient / retry_delay
+#  whether a failed fetch is worth retrying in the same crawl, and
+#  the jittered exponential wait before retry number 'attempt'
+#
+#################################################################
+
+
+def is_transient(result):
+    return result.error in TRANSIENT_ERRORS or result.status in TRANSIENT_STATUS
+
+
+def retry_delay(attempt, backoff=1.0):
+    return backoff * 2**attempt * random.uniform(0.5, 1.5)
+
+
+# end is_transient / retry_delay  #####
+
+#################################################################
+# FUNCTION next_host_health
+#  the host_health entry of a host after a fetch: a host answering
+#  with any status below 500 is alive, its latency is a moving
+#  average of the time to first byte. Every other outcome adds one
+#  to its run of consecutive failed crawls.
+#
+#################################################################
+
+
+def next_host_health(health, result, now):
+    failures, last_success, last_attempt, latency = health or (0, 0.0, 0.0, 0.0)
+    if 0 < result.status < 500:
+        failures = 0
+        last_success = now
+        latency = result.ttfb if latency <= 0 else latency * 0.7 + result.ttfb * 0.3
+    else:
+        failures += 1
+
+    return (failures, last_success, now, latency)
+
+
+# end next_host_health  #####
+
+#################################################################
+# FUNCTION is_dormant / skip_dormant
+#  hosts that failed 'dead_after' crawls in a row are only tried
+#  again once every 'dead_recheck' seconds. skip_dormant filters an
+#  iterable of hosts and counts the skipped ones in
+#  stats["dormant"].
+#
+#################################################################
+
+
+def is_dormant(health, now, dead_after=5, dead_recheck=604800):
+    return (
+        bool(health)
+        and 0 < dead_after <= health[0]
+        and now - health[2] < dead_recheck
+    )
+
+
+def skip_dormant(hosts, host_health, dead_after=5, dead_recheck=604800, stats=None):
+    now = time.time()
+    if stats is None:
+        stats = {}
+    stats.setdefault("dormant", 0)
+    for host in hosts:
+        if is_dormant(host_health.get(host), now, dead_after, dead_recheck):
+            stats["dormant"] += 1
+            continue
+        yield host
+
+
+# end is_dormant / skip_dormant  #####
+
+#################################################################
+# CLASS RecordBuffer
+#  list usable as a sink, collects the rows of one host so they can
+#  be handed to the writer queue in one go
+#
+#################################################################
+
+
+class RecordBuffer(list):
+    put = list.append
+
+
+# end RecordBuffer  #####
+
+#################################################################
+# FUNCTION percentiles
+#  the p50/p95/p99 (or 'points') of a sample of durations
+#
+#################################################################
+
+
+def percentiles(values, points=(50, 95, 99)):
+    values = sorted(values)
+    if not values:
+        return [0.0 for _ in points]
+
+    return [values[min(len(values) - 1, len(values) * p // 100)] for p in points]
+
+
+# end percentiles  #####
+
+#################################################################
+# FUNCTION format_progress
+#  one line crawl summary: throughput since the start and the
+#  latency percentiles of every instrumented stage
+#
+#################################################################
+
+
+def format_progress(totals, latencies, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    line = (
+        f"{totals['processed']} hosts {totals['processed'] / elapsed:.1f}/s, "
+        f"{totals['records']} records {totals['records'] / elapsed:.1f}/s, "
+        f"db write {totals.get('commit_seconds', 0.0):.2f}s"
+    )
+    for stage, values in latencies.items():
+        if values:
+            p50, p95, p99 = percentiles(values)
+            line += f" | {stage} p50 {p50 * 1000:.0f}ms p95 {p95 * 1000:.0f}ms p99 {p99 * 1000:.0f}ms"
+
+    return line
+
+
+# end format_progress  #####
+
+#################################################################
+# CLASS TokenBucket
+#  request rate limit: 'rate' tokens a second, at most 'burst' of
+#  them saved up while idle. Clock readings are passed in, so one
+#  bucket costs no timer.
+#
+#################################################################
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = now
+
+    # seconds until a token is available at 'now', 0.0 if one is
+    def wait(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1.0 else (1.0 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+
+# end TokenBucket  #####
+
+#################################################################
+# CLASS IpScheduler
+#  politeness scheduler between the crawl frontier and the fetchers.
+#  Work items are grouped by the IP their host resolved to, so the
+#  many sites behind one CDN or hosting address share its limits:
+#  at most 'per_ip' fetches in flight and 'rate' fetches a second
+#  ('burst' at once) per group, 0 for no limit. get() serves the
+#  groups round-robin, and a group that is at its limit leaves the
+#  rotation until a fetch of it finishes or its bucket refills, so
+#  the fetchers keep working on the other groups meanwhile.
+#
+#################################################################
+
+
+class IpScheduler:
+    def __init__(self, per_ip=0, rate=0.0, burst=0.0):
+        self.per_ip = per_ip
+        self.rate = rate
+        self.burst = burst or rate
+        # ip: [queued items, fetches in flight, TokenBucket, state]
+        self.groups = {}
+        # groups with queued items that may dispatch now
+        self.ready = deque()
+        self.wakeup = asyncio.Event()
+        self.throttled = 0
+
+    def put(self, ip, item):
+        group = self.groups.get(ip)
+        if group is None:
+            bucket = None
+            if self.rate > 0:
+                bucket = TokenBucket(
+                    self.rate, self.burst, asyncio.get_running_loop().time()
+                )
+            group = self.groups[ip] = [deque(), 0, bucket, None]
+        group[0].append(item)
+        if group[3] is None:
+            self.resume(ip)
+
+    # put group 'ip' back into the rotation
+    def resume(self, ip):
+        group = self.groups[ip]
+        group[3] = None
+        if group[0]:
+            group[3] = "ready"
+            self.ready.append(ip)
+            self.wakeup.set()
+
+    # returns (ip, item) once a group may fetch, see done()
+    async def get(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while self.ready:
+                ip = self.ready.popleft()
+                group = self.groups[ip]
+                if self.per_ip and group[1] >= self.per_ip:
+                    # back in the rotation on the next done()
+                    group[3] = "busy"
+                    self.throttled += 1
+                    continue
+                if group[2] is not None:
+                    wait = group[2].wait(loop.time())
+                    if wait > 0:
+                        group[3] = "waiting"
+                        self.throttled += 1
+                        loop.call_later(wait, self.resume, ip)
+                        continue
+                    group[2].take()
+                item = group[0].popleft()
+                group[1] += 1
+                if group[0]:
+                    self.ready.append(ip)
+                else:
+                    group[3] = None
+                return ip, item
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    # a fetch of group 'ip' handed out by get() finished
+    def done(self, ip):
+        group = self.groups[ip]
+        group[1] -= 1
+        if group[3] == "busy":
+            self.resume(ip)
+
+
+# end IpScheduler  #####
+
+#################################################################
+# FUNCTION crawl_async.
+#  event loop crawl engine: keeps up to 'concurrency' fetches in
+#  flight, at most 'per_host' of them (spaced 'host_delay' seconds
+#  apart) against the same host. With 'per_ip' or 'ip_rate' the
+#  hosts are grouped by IP and the groups limited and interleaved by
+#  an IpScheduler; the IPs come from 'dns_cache' (see
+#  resolve_targets), referred hosts are resolved on the way in.
+#  Fetched files are handed to a
+#  consumer stage that parses them, which in turn queues the rows
+#  for the single db_writer thread, so neither the fetchers nor
+#  the parser ever wait on the SQLite lock.
+#  The rows are written to 'storage' (see adstxt_storage), by
+#  default the SQLite DB 'database' with the 'pragmas' settings;
+#  the crawl bookkeeping is always read from 'database'.
+#  'adsystem_ids' is shared read-only by the parse stage; with
+#  'adsystem_reload' > 0 the table is re-read that often and the
+#  mapping swapped when it changed.
+#  'crawl_state' (see load_crawl_state) makes the fetches
+#  conditional, pass an empty dict to force a full recrawl.
+#  The fetches are coroutines sharing one aiohttp session, see
+#  open_session; only the parse stage and the DB writer run on a
+#  thread of their own.
+#  With a 'job' name every finished host is journaled in crawl_job,
+#  queued behind its data rows, so a host only counts as done once
+#  the batch holding all its rows has been committed.
+#  'stats' is filled with the running counts of the crawl, a
+#  summary with the throughput and the per stage latencies is logged
+#  every 'progress_interval' seconds. With 'metrics_file' a JSON line
+#  with the timings, size, status and row count of every host is
+#  appended to it; 'dns_times' holds the lookup durations measured
+#  by resolve_targets.
+#  Hosts named by subdomain=, contentproducerdomain= and
+#  contentdistributordomain= go back into the same frontier, up to
+#  'max_depth' referral hops from a target; every host is fetched
+#  at most once per crawl.
+#  'host_health' (see load_host_health) sets the timeouts of every
+#  fetch, see adaptive_timeout. Timeouts, connection errors and
+#  5xx/429 answers are retried up to 'retries' times after a
+#  jittered backoff, without holding a fetch slot while waiting.
+#  Referred hosts that failed 'dead_after' crawls in a row are
+#  skipped until 'dead_recheck' seconds after their last attempt,
+#  and get no retries when they are due.
+#  With a 'raw_store' directory every served body is kept there,
+#  see store_raw_response. Bodies over 'max_size' bytes are dropped.
+#
+#################################################################
+
+
+async def crawl_async(
+    hosts,
+    database,
+    concurrency=64,
+    per_host=1,
+    host_delay=0.0,
+    batch_size=5000,
+    pragmas=DEFAULT_PRAGMAS,
+    adsystem_ids=None,
+    adsystem_reload=0.0,
+    crawl_state=None,
+    max_redirects=5,
+    job=None,
+    stats=None,
+    max_depth=1,
+    metrics_file=None,
+    dns_times=None,
+    progress_interval=10.0,
+    host_health=None,
+    timeout=5.0,
+    retries=2,
+    retry_backoff=1.0,
+    dead_after=5,
+    dead_recheck=604800,
+    raw_store=None,
+    storage=None,
+    max_size=MAX_BODY_SIZE,
+    dns_cache=None,
+    per_ip=0,
+    ip_rate=0.0,
+    ip_burst=0.0,
+):
+    loop = asyncio.get_running_loop()
+    if storage is None:
+        storage = SQLiteStorage(database, pragmas)
+    parse_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="adstxt_parse")
+    writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="adstxt_db")
+    record_queue = queue.Queue(maxsize=batch_size * 4)
+
+    # frontier items are (host, depth, attempt), depth 0 for targets; the
+    # backlog semaphore keeps the target iterator from being drained into
+    # memory up front, referrals are bounded by the seen-map instead.
+    # The backlog is also the window the scheduler interleaves IPs over.
+    frontier = asyncio.Queue()
+    backlog = asyncio.Semaphore(concurrency * (16 if per_ip or ip_rate > 0 else 4))
+    scheduler = IpScheduler(per_ip, ip_rate, ip_burst)
+    if dns_cache is None:
+        dns_cache = {}
+    resolving = set()
+    parse_queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    host_slots = {}
+    host_users = {}
+    host_last = {}
+    # host digest: lowest depth the host was reached at
+    seen = {}
+    # hosts processed at max_depth, whose referrals were not followed
+    capped = set()
+    totals = stats if stats is not None else {}
+    for key in (
+        "records", "processed", "fetched", "unchanged", "referrals", "retries", "dormant",
+        "throttled",
+    ):
+        totals.setdefault(key, 0)
+    # rejected records per reason, see adstxt_validator
+    rejected = totals.setdefault("rejected", Counter())
+    if adsystem_ids is None:
+        adsystem_ids = storage.load_adsystem_ids()
+    if crawl_state is None:
+        crawl_state = load_crawl_state(database)
+    if host_health is None:
+        host_health = load_host_health(database)
+    adsystem = {"ids": adsystem_ids, "next_reload": loop.time() + adsystem_reload}
+
+    # recent samples per stage, shared by all workers
+    latencies = {
+        stage: deque(maxlen=10000)
+        for stage in ("dns", "connect", "ttfb", "fetch", "parse", "write", "commit")
+    }
+    if dns_times is None:
+        dns_times = {}
+    metrics_out = open(metrics_file, "a", encoding="utf-8") if metrics_file else None
+    started = loop.time()
+
+    # record that 'digest' was reached at 'depth', returns whether the
+    # host must be queued: when it is new, or when it was processed at
+    # max_depth and is now reached closer to a target. A host still
+    # queued just gets the lower depth, see consumer().
+    def visit(digest, depth):
+        known = seen.get(digest)
+        if known is None:
+            seen[digest] = depth
+            return True
+        if depth >= known:
+            return False
+        seen[digest] = depth
+        if digest in capped and depth < max_depth:
+            capped.discard(digest)
+            return True
+        return False
+
+    async def push_target(host):
+        if visit(host_digest(host), 0):
+            await backlog.acquire()
+            frontier.put_nowait((host, 0, 0))
+
+    async def feed():
+        if hasattr(hosts, "__aiter__"):
+            async for host in hosts:
+                await push_target(host)
+        else:
+            for host in hosts:
+                await push_target(host)
+
+    def push_referrals(referral_domains, depth):
+        now = time.time()
+        for rhost in referral_domains:
+            rhost = normalize_host(rhost)
+            if rhost is None:
+                continue
+            if visit(host_digest(rhost), depth):
+                if is_dormant(host_health.get(rhost), now, dead_after, dead_recheck):
+                    totals["dormant"] += 1
+                    continue
+                totals["referrals"] += 1
+                frontier.put_nowait((rhost, depth, 0))
+
+    def requeue(item):
+        # the retry is queued before the failed attempt is marked done,
+        # so frontier.join() keeps waiting through the backoff
+        frontier.put_nowait(item)
+        frontier.task_done()
+
+    async def polite_fetch(host):
+        key = host.lower()
+        if key not in host_slots:
+            host_slots[key] = asyncio.Semaphore(per_host)
+            host_users[key] = 0
+        host_users[key] += 1
         try:
-            c.execute(
-                insert_stmt,
+            async with host_slots[key]:
+                if host_delay > 0:
+                    wait = host_last.get(key, 0.0) + host_delay - loop.time()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    host_last[key] = loop.time()
+                state = crawl_state.get(key) or ("", "")
+                return await fetch_adstxt(
+                    session,
+                    host,
+                    state[0],
+                    state[1],
+                    adaptive_timeout(host_health.get(key), timeout),
+                    max_size,
+                    max_redirects,
+                )
+        finally:
+            host_users[key] -= 1
+            if host_users[key] == 0:
+                del host_users[key]
+                del host_slots[key]
+
+    # referred hosts were not pre-resolved, looked up off the event loop
+    async def schedule_resolved(item):
+        name = item[0].split(":")[0].lower()
+        try:
+            ip = (await loop.run_in_executor(None, resolve_host, item[0]))[1]
+            dns_cache[name] = (ip, time.time())
+        except Exception:
+            ip = ""
+        scheduler.put(ip or name, item)
+
+    # hands the frontier items to the scheduler grouped by IP, all in
+    # one group when there are no per IP limits
+    async def router():
+        while True:
+            item = await frontier.get()
+            if not (per_ip or ip_rate > 0):
+                scheduler.put("", item)
+                continue
+            name = item[0].split(":")[0].lower()
+            cached = dns_cache.get(name)
+            if cached:
+                scheduler.put(cached[0] or name, item)
+            else:
+                task = asyncio.create_task(schedule_resolved(item))
+                resolving.add(task)
+                task.add_done_callback(resolving.discard)
+
+    async def fetcher():
+        while True:
+            ip, (host, depth, attempt) = await scheduler.get()
+            if depth == 0 and attempt == 0:
+                backlog.release()
+            try:
+                result = await polite_fetch(host)
+            except Exception:
+                logging.exception(f"fetch failed for {host}")
+                result = FetchResult(host, 0, None, "", "", error="error")
+            finally:
+                scheduler.done(ip)
+                totals["throttled"] = scheduler.throttled
+            health = host_health.get(host.lower())
+            max_retries = 0 if health and 0 < dead_after <= health[0] else retries
+            if attempt < max_retries and is_transient(result):
+                delay = retry_delay(attempt, retry_backoff)
+                logging.info(
+                    f"retrying {host} in {delay:.1f}s ({result.error or result.status})"
+                )
+                totals["retries"] += 1
+                loop.call_later(delay, requeue, (host, depth, attempt + 1))
+                continue
+            await parse_queue.put((result, depth, attempt))
+
+    def parse_job(result, depth, attempt):
+        start = time.perf_counter()
+        key = result.host.lower()
+        state = crawl_state.get(key)
+        rows = RecordBuffer()
+        processed = process_fetch_result(rows, adsystem["ids"], result, state)
+        health = next_host_health(host_health.get(key), result, time.time())
+        last_error = result.error
+        if not last_error and result.status >= 500:
+            last_error = str(result.status)
+        rows.put(("host_health", (key, *health, last_error)))
+        if raw_store and result.body is not None:
+            store_raw_response(raw_store, result.body, result.digest)
+            rows.put(
                 (
-                    hostname,
-                    exchange_host,
-                    adsystem_id,
-                    seller_account_id,
-                    account_type,
-                    tag_id,
-                    comment,
-                ),
+                    "raw_response",
+                    (key, time.time(), result.digest, result.status, result.charset),
+                )
             )
-            # Save (commit) the changes
-            conn.commit()
-            if c.rowcount > 0:
-                sql_rows = c.rowcount
-        except sqlite3.OperationalError as err:  # Changed exception handling
-            print(err)
-            print(insert_stmt)
-            print(
-                hostname,
-                exchange_host,
-                adsystem_id,
-                seller_account_id,
-                account_type,
-                tag_id,
-                comment,
+        if job:
+            rows.put(("crawl_job", (job, result.host, result.status)))
+        parsed = time.perf_counter()
+
+        # blocks while the writer is behind, i.e. on the SQLite commits
+        for row in rows:
+            record_queue.put(row)
+        written = time.perf_counter()
+
+        timings = {
+            "dns": dns_times.pop(result.host, None),
+            "connect": result.connect,
+            "ttfb": result.ttfb,
+            "fetch": result.fetch,
+            "parse": parsed - start,
+            "write": written - parsed,
+        }
+        for stage, value in timings.items():
+            if value is not None:
+                latencies[stage].append(value)
+
+        if metrics_out:
+            metrics_out.write(
+                json.dumps(
+                    {
+                        "host": result.host,
+                        "depth": depth,
+                        "status": result.status,
+                        "bytes": result.size,
+                        "rows": processed[0],
+                        "unchanged": processed[2],
+                        "rejected": len(processed[3]),
+                        "attempts": attempt + 1,
+                        "error": result.error,
+                        **{
+                            k: None if v is None else round(v, 6)
+                            for k, v in timings.items()
+                        },
+                    }
+                )
+                + "\n"
             )
+        return processed
 
-    return sql_rows
+    def reload_adsystem_ids():
+        adsystem_ids = storage.load_adsystem_ids()
+        if adsystem_ids != adsystem["ids"]:
+            logging.warning(f"Reloaded {len(adsystem_ids)} adsystem domains")
+            adsystem["ids"] = adsystem_ids
+
+    async def consumer():
+        while True:
+            result, depth, attempt = await parse_queue.get()
+            try:
+                if adsystem_reload > 0 and loop.time() >= adsystem["next_reload"]:
+                    adsystem["next_reload"] = loop.time() + adsystem_reload
+                    await loop.run_in_executor(parse_pool, reload_adsystem_ids)
+                referral_domains, unchanged, rejections = (
+                    await loop.run_in_executor(
+                        parse_pool, parse_job, result, depth, attempt
+                    )
+                )[1:]
+                rejected.update(r.reason for r in rejections)
+                if result.text is not None or result.status == 304:
+                    totals["fetched"] += 1
+                if unchanged:
+                    totals["unchanged"] += 1
+                totals["processed"] += 1
+                # the host may have been reached closer to a target meanwhile
+                digest = host_digest(result.host)
+                depth = min(depth, seen.get(digest, depth))
+                if depth < max_depth:
+                    push_referrals(referral_domains, depth + 1)
+                else:
+                    capped.add(digest)
+            except Exception:
+                logging.exception(f"parse failed for {result.host}")
+            finally:
+                frontier.task_done()
+
+    async def progress():
+        while True:
+            await asyncio.sleep(progress_interval)
+            logging.warning(format_progress(totals, latencies, loop.time() - started))
+
+    session = open_session(concurrency, dns_cache)
+    writer = loop.run_in_executor(
+        writer_pool,
+        functools.partial(
+            db_writer,
+            storage,
+            record_queue,
+            batch_size,
+            stats=totals,
+            latencies=latencies,
+        ),
+    )
+    workers = [asyncio.create_task(fetcher()) for _ in range(concurrency)]
+    workers.append(asyncio.create_task(router()))
+    workers.append(asyncio.create_task(consumer()))
+    if progress_interval > 0:
+        workers.append(asyncio.create_task(progress()))
+    try:
+        await feed()
+        await frontier.join()
+    finally:
+        for w in workers + list(resolving):
+            w.cancel()
+        await asyncio.gather(*workers, *resolving, return_exceptions=True)
+        await session.close()
+        parse_pool.shutdown()
+        await loop.run_in_executor(None, record_queue.put, None)
+        totals["records"] = await writer
+        writer_pool.shutdown()
+        if metrics_out:
+            metrics_out.close()
+
+    logging.warning(
+        f"Fetched {totals['fetched']} ads.txt files, {totals['unchanged']} unchanged, "
+        f"{totals['referrals']} referred hosts, {totals['retries']} retries, "
+        f"{totals['dormant']} dormant hosts skipped"
+    )
+    if per_ip or ip_rate > 0:
+        logging.warning(
+            f"Scheduled {len(scheduler.groups)} IP groups, "
+            f"{totals['throttled']} times held back by --per_ip/--ip_rate"
+        )
+    if rejected:
+        logging.warning(f"Rejected records: {dict(rejected.most_common())}")
+    logging.warning(format_progress(totals, latencies, loop.time() - started))
+    return totals["records"]
 
 
-# end process_adstxt_row_to_db  #####
+# end crawl_async  #####
 
 #################################################################
-# FUNCTION process_contentdirective_row_to_db.
-#  handle one row and push to the DB
+# FUNCTION adstxt_file_host
+#  the site domain of a stored ads.txt file from its path, one of
+#    example.com/ads.txt  (a mirror, one directory per site)
+#    example.com.txt, example.com_ads.txt, example.com-ads.txt
+#    example_com_ads.txt  (like fakeserver/, the last '_' is a dot)
+#  returns None when no hostname can be made out of it
 #
 #################################################################
 
 
-def process_contentdirective_row_to_db(
-    conn, case, site_hostname, rhs_hostname, comment
-):
-    insert_stmt = ""
-    sql_rows = 0
+def adstxt_file_host(name):
+    parts = name.replace("\\", "/").strip("/").split("/")
+    base = parts[-1]
+    if base.lower() == "ads.txt":
+        return normalize_host(parts[-2]) if len(parts) > 1 else None
 
-    site_hostname = site_hostname.lower().strip()
-    rhs_hostname = rhs_hostname.lower().strip()
+    for suffix in ("_ads.txt", "-ads.txt", ".ads.txt", ".txt"):
+        if base.lower().endswith(suffix):
+            stem = base[: -len(suffix)]
+            break
+    else:
+        return None
+    if "." not in stem and "_" in stem:
+        head, _, tld = stem.rpartition("_")
+        stem = f"{head}.{tld}"
 
-    data_valid = 1
+    return normalize_host(stem)
 
-    # Minimum length of a domain name is 1 character, not including extensions.
-    # Domain Name Rules - Nic AG
-    # www.nic.ag/rules.htm
-    if len(site_hostname) < 3:
-        data_valid = 0
 
-    if len(rhs_hostname) < 3:
-        data_valid = 0
+# end adstxt_file_host  #####
+
+#################################################################
+# FUNCTION iter_adstxt_files
+#  lazily yield (host, content bytes) for every ads.txt file in a
+#  directory tree, a zip or a (compressed) tar archive. Tar archives
+#  are read as a stream, so a large dump is never unpacked on disk
+#  nor held in memory. Files over 'max_size' bytes are skipped
+#  unread.
+#
+#################################################################
+
+
+def iter_adstxt_files(path, max_size=MAX_BODY_SIZE):
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full_name = os.path.join(root, name)
+                host = adstxt_file_host(os.path.relpath(full_name, path))
+                if host is None:
+                    logging.warning(f"skipped {full_name}, no site domain in its name")
+                    continue
+                if os.path.getsize(full_name) > max_size:
+                    logging.warning(f"skipped {full_name}, larger than {max_size} bytes")
+                    continue
+                with open(full_name, "rb") as f:
+                    yield host, f.read()
+
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                host = adstxt_file_host(info.filename)
+                if host is None:
+                    logging.warning(f"skipped {info.filename}, no site domain in its name")
+                    continue
+                if info.file_size > max_size:
+                    logging.warning(f"skipped {info.filename}, larger than {max_size} bytes")
+                    continue
+                yield host, archive.read(info)
+
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                host = adstxt_file_host(member.name)
+                if host is None:
+                    logging.warning(f"skipped {member.name}, no site domain in its name")
+                    continue
+                if member.size > max_size:
+                    logging.warning(f"skipped {member.name}, larger than {max_size} bytes")
+                    continue
+                yield host, archive.extractfile(member).read()
 
-    if case == "cd":
-        insert_stmt = "INSERT OR REPLACE INTO adstxt_contentdistributor (SITE_DOMAIN, PRODUCER_DOMAIN, ENTRY_COMMENT) VALUES (?, ?, ?);"
-    elif case == "cp":
-        insert_stmt = "INSERT OR REPLACE INTO adstxt_contentproducer (SITE_DOMAIN, DISTRIBUTOR_DOMAIN, ENTRY_COMMENT) VALUES (?, ?, ?);"
     else:
-        data_valid = 0
+        raise ValueError(f"{path} is not a directory, a zip or a tar archive")
+
+
+# end iter_adstxt_files  #####
+
+#################################################################
+# FUNCTION import_adstxt_files
+#  load stored ads.txt files instead of crawling them: 'files'
+#  yields (host, content bytes), see iter_adstxt_files, or (host,
+#  content bytes, charset) for stored responses, decoded like they
+#  were when fetched, see iter_raw_responses. Every file
+#  goes through process_fetch_result like a fetched one, on
+#  'workers' parse threads, and the rows are committed by a
+#  db_writer thread to 'storage', by default the SQLite DB
+#  'database'. HTML pages are skipped, files identical to the last
+#  crawl are left alone unless 'reparse' is set. The ETag and
+#  Last-Modified of the last crawl are kept for the files identical
+#  to it, so the next crawl can still make conditional requests.
+#  'stats' gets the counts of files, unchanged and html files.
+#  returns the number of records written
+#
+#################################################################
+
+
+def import_adstxt_files(
+    files,
+    database,
+    workers=4,
+    batch_size=5000,
+    pragmas=DEFAULT_PRAGMAS,
+    adsystem_ids=None,
+    crawl_state=None,
+    stats=None,
+    storage=None,
+    reparse=False,
+):
+    totals = stats if stats is not None else {}
+    for key in ("files", "unchanged", "html"):
+        totals.setdefault(key, 0)
+    rejected = totals.setdefault("rejected", Counter())
+    if storage is None:
+        storage = SQLiteStorage(database, pragmas)
+    if adsystem_ids is None:
+        adsystem_ids = storage.load_adsystem_ids()
+    if crawl_state is None:
+        crawl_state = load_crawl_state(database)
+
+    record_queue = queue.Queue(maxsize=batch_size * 4)
+    writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="adstxt_db")
+    writer = writer_pool.submit(
+        db_writer, storage, record_queue, batch_size, stats=totals
+    )
 
-    if data_valid > 0:
-        logging.debug(
-            "%s | %s | %s | %s" % (case, site_hostname, rhs_hostname, comment)
+    def parse_file(host, content, charset=None):
+        if charset is None:
+            text = content.decode("utf-8", "ignore")
+        else:
+            text = body_decoder(charset).decode(content, True)
+        if looks_like_html(text):
+            logging.warning(f"skipped {host}, HTML page")
+            return None
+        # no validators, these were not served by the host itself
+        result = FetchResult(
+            host,
+            200,
+            text,
+            None,
+            None,
+            len(content),
+            digest=hashlib.sha1(content).hexdigest(),
         )
+        rows = RecordBuffer()
+        processed = process_fetch_result(
+            rows, adsystem_ids, result, crawl_state.get(host), reparse
+        )
+        for row in rows:
+            record_queue.put(row)
+        return processed
+
+    def count(done):
+        for future in done:
+            processed = future.result()
+            totals["files"] += 1
+            if processed is None:
+                totals["html"] += 1
+            else:
+                if processed[2]:
+                    totals["unchanged"] += 1
+                rejected.update(r.reason for r in processed[3])
 
-        # Insert a row of data using bind variables (protect against SQL injection)
-        c = conn.cursor()
-        try:
-            c.execute(insert_stmt, (site_hostname, rhs_hostname, comment))
-            # Save (commit) the changes
-            conn.commit()
-            if c.rowcount > 0:
-                sql_rows = c.rowcount
-        except sqlite3.OperationalError as err:
-            print(err)
-            print(insert_stmt)
-            print(case, site_hostname, rhs_hostname, comment)
+    try:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="adstxt_parse"
+        ) as parse_pool:
+            # a bounded window of files in flight, the rest stays unread
+            pending = set()
+            for item in files:
+                if len(pending) >= workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    count(done)
+                pending.add(parse_pool.submit(parse_file, *item))
+            count(wait(pending)[0])
+    finally:
+        record_queue.put(None)
+        totals["records"] = writer.result()
+        writer_pool.shutdown()
+
+    logging.warning(
+        f"Imported {totals['files']} ads.txt files, {totals['unchanged']} unchanged, "
+        f"{totals['html']} HTML pages skipped"
+    )
+    if rejected:
+        logging.warning(f"Rejected records: {dict(rejected.most_common())}")
+    return totals["records"]
+
+
+# end import_adstxt_files  #####
+
+#################################################################
+# FUNCTION raw_store_path / store_raw_response / load_raw_response
+#  the raw response store is a directory of gzipped ads.txt bodies,
+#  the bytes as served, named after their SHA-1 (the CONTENT_HASH of
+#  crawl_state), so a file served by many sites is stored once. The
+#  raw_response table indexes them by host and crawl time, with the
+#  charset each host served them with.
+#
+#################################################################
+
+
+def raw_store_path(raw_store, content_hash):
+    return os.path.join(raw_store, content_hash[:2], content_hash[2:] + ".gz")
 
-    return sql_rows
 
+def store_raw_response(raw_store, content, content_hash):
+    path = raw_store_path(raw_store, content_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, a reader never sees half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
 
-# end process_contentdirective_row_to_db  #####
 
+def load_raw_response(raw_store, content_hash):
+    with gzip.open(raw_store_path(raw_store, content_hash), "rb") as f:
+        return f.read()
+
+
+# end raw_store_path / store_raw_response / load_raw_response  #####
 
 #################################################################
-# FUNCTION crawl_to_db.
-#  crawl the URLs, parse the data, validate and dump to a DB
+# FUNCTION iter_raw_responses
+#  lazily yield (host, content bytes, charset) of the latest stored
+#  response of every host, for import_adstxt_files to replay
 #
 #################################################################
 
 
-def crawl_to_db(ahost, referral_domain=False):
-    rowcnt = 0
-    referral_domains = []
+def iter_raw_responses(database, raw_store):
+    # SQLite takes the bare columns from the row holding MAX(CRAWLED)
+    select_stmt = "SELECT HOST, CONTENT_HASH, CHARSET, MAX(CRAWLED) FROM raw_response GROUP BY HOST"
+    conn = sqlite3.connect(database, timeout=10)
+    try:
+        for host, content_hash, charset, _ in conn.execute(select_stmt):
+            try:
+                content = load_raw_response(raw_store, content_hash)
+            except OSError as e:
+                logging.warning(f"missing raw response of {host}: {e}")
+                continue
+            yield host, content, charset
+    finally:
+        conn.close()
 
-    logging.debug(f"crawl_to_db ({ahost})")
 
-    myheaders = {
-        "User-Agent": "AdsTxtCrawler/1.0; +https://github.com/InteractiveAdvertisingBureau/adstxtcrawler",
-        "Accept": "text/plain",
-    }
+# end iter_raw_responses  #####
+
+#################################################################
+# FUNCTION parse_shard / in_shard
+#  '--shard I/N' is shard I (0 to N-1) of N; a host belongs to the
+#  shard its 64-bit digest falls in, so every node running with the
+#  same N splits any target list the same way
+#
+#################################################################
 
-    aurl = f"http://{ahost}/ads.txt"
-    logging.info(f" Crawling  {aurl} : {ahost} ")
 
-    accept = False
+def parse_shard(value):
     try:
-        r = requests.get(aurl, headers=myheaders, timeout=5)
-        logging.info(f"  {r.status_code}")
-        if r.status_code == 200:
-            text = r.text.lower()
-            # ignore html file
-            if (
-                "html" not in text
-                and "body" not in text
-                and "div" not in text
-                and "span" not in text
-            ):
-                accept = True
-    except:
+        shard, shards = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise ArgumentTypeError(f"{value} is not I/N")
+    if not 0 <= shard < shards:
+        raise ArgumentTypeError(f"shard {shard} is not between 0 and {shards - 1}")
+
+    return shard, shards
+
+
+def in_shard(host, shard, shards):
+    return host_digest(host) % shards == shard
+
+
+# end parse_shard / in_shard  #####
+
+#################################################################
+# FUNCTION write_shard_marker / clear_shard_marker / read_shard_markers
+#  a shard that finished its crawl leaves shard-I-of-N.json in the
+#  shared 'shard_dir', naming its DB file and stamped with the
+#  'run_id' of the crawl; a shard starting a crawl removes its marker
+#  of the previous run first. The merge step reads them back, sorted
+#  by finish time, and tells which shards are missing. No markers,
+#  markers of different runs or shard counts, or of another run than
+#  'run_id' raise a ValueError rather than merging a partial run or
+#  mixing runs in one merge.
+#
+#################################################################
+
+
+def shard_marker_path(shard_dir, shard, shards):
+    return os.path.join(shard_dir, f"shard-{shard}-of-{shards}.json")
+
+
+def write_shard_marker(shard_dir, shard, shards, database, stats, run_id=""):
+    os.makedirs(shard_dir, exist_ok=True)
+    marker = shard_marker_path(shard_dir, shard, shards)
+    with open(marker + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "shard": shard,
+                "shards": shards,
+                "run_id": run_id,
+                "database": os.path.abspath(database),
+                "finished": time.time(),
+                **stats,
+            },
+            f,
+        )
+    os.replace(marker + ".tmp", marker)
+
+    return marker
+
+
+def clear_shard_marker(shard_dir, shard, shards):
+    try:
+        os.remove(shard_marker_path(shard_dir, shard, shards))
+    except FileNotFoundError:
         pass
 
-    if accept:
-        text = re.sub(re.compile("[^\x20-\x7E\r\n]"), "", r.text)
-
-        logging.debug("-------------")
-        logging.debug(r.request.headers)
-        logging.debug("-------------")
-        logging.debug(f"{text}")
-        logging.debug("-------------")
-
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_csv_file:
-            tmpfile = tmp_csv_file.name
-            tmp_csv_file.write(text.encode("utf-8"))
-
-        with open(tmpfile, "r", encoding="utf-8", newline="") as tmp_csv_file:
-            # read the line, split on first comment and keep what is to the
-            # left (if any found)
-            line_reader = csv.reader(tmp_csv_file, delimiter="#", quotechar="|")
-            comment = ""
-
-            conn = sqlite3.connect(database, timeout=10)
-            with conn:
-                for line in line_reader:
-                    logging.debug(f"DATA:  {line}")
-
-                    try:
-                        data_line = line[0]
-                    except:
-                        data_line = ""
-
-                    # determine delimiter, conservative = do it per row
-                    data_delimiter = ","
-                    if data_line.find("\t") != -1:
-                        data_delimiter = "\t"
-
-                    data_reader = csv.reader(
-                        [data_line], delimiter=data_delimiter, quotechar="|"
-                    )
-                    for row in data_reader:
-                        if len(row) > 0 and row[0].startswith("#"):
-                            continue
 
-                        directive_pattern = "domain="
-                        if len(row) > 0 and directive_pattern in row[0].lower():
-                            logging.debug(f"DIRECTIVE [{row}]")
-                            s = row[0].lower().split("=")
-                            rhs_host = ""
-                            comment = ""
-                            if len(s) > 1:
-                                lhs = s[0].strip()
-                                rhs = s[1].strip().split("#")
+def read_shard_markers(shard_dir, run_id=None):
+    markers = []
+    for name in sorted(os.listdir(shard_dir)):
+        if re.match(r"^shard-[0-9]+-of-[0-9]+\.json$", name):
+            with open(os.path.join(shard_dir, name), encoding="utf-8") as f:
+                markers.append(json.load(f))
+    markers.sort(key=lambda marker: marker["finished"])
+
+    if not markers:
+        run = f" of run {run_id!r}" if run_id is not None else ""
+        raise ValueError(f"No shard markers{run} in {shard_dir}, no shard has finished")
+    run_ids = {marker.get("run_id", "") for marker in markers}
+    if run_id is not None and run_ids - {run_id}:
+        raise ValueError(f"Shard markers of another run than {run_id!r} in {shard_dir}")
+    if len(run_ids) > 1:
+        raise ValueError(f"Shard markers of runs {sorted(run_ids)} in {shard_dir}")
+    counts = {marker["shards"] for marker in markers}
+    if len(counts) > 1:
+        raise ValueError(f"Shard markers of {sorted(counts)} shard counts in {shard_dir}")
+
+    missing = []
+    for shards in counts:
+        done = {marker["shard"] for marker in markers}
+        missing = [f"{i}/{shards}" for i in range(shards) if i not in done]
+
+    return markers, missing
+
+
+# end write_shard_marker / clear_shard_marker / read_shard_markers  #####
+
+#################################################################
+# FUNCTION iter_shard_sites
+#  lazily yield (site, [(site table key, row), ...]) for every site
+#  whose content a shard DB holds, i.e. that has a crawl_state row
+#  with a content hash, by walking the site tables in SITE_DOMAIN
+#  order side by side
+#
+#################################################################
+
+
+def iter_shard_sites(conn):
+    cursors = {}
+    for table_key, (table, columns, key) in SITE_TABLES.items():
+        cursors[table_key] = conn.execute(
+            f"SELECT {', '.join(columns)} FROM {table} ORDER BY SITE_DOMAIN"
+        )
+    heads = {table_key: next(cursor, None) for table_key, cursor in cursors.items()}
+
+    sites = conn.execute(
+        "SELECT HOST FROM crawl_state WHERE CONTENT_HASH != '' ORDER BY HOST"
+    )
+    for (site,) in sites:
+        rows = []
+        for table_key, cursor in cursors.items():
+            row = heads[table_key]
+            while row is not None and row[0] <= site:
+                if row[0] == site:
+                    rows.append((table_key, row))
+                row = next(cursor, None)
+            heads[table_key] = row
+        yield site, rows
+
+
+# end iter_shard_sites  #####
+
+#################################################################
+# FUNCTION merge_shards
+#  combine shard DBs into 'storage': the content of every site a
+#  shard crawled replaces the stored one (see write_site), and the
+#  crawl_state, host_health and raw_response rows are copied over.
+#  A site crawled by several shards keeps the content of the last
+#  one merged, pass the shards oldest first.
+#  returns the number of site rows changed
+#
+#################################################################
+
+
+def merge_shards(shard_databases, storage, batch_size=5000):
+    sql_rows = 0
+    for shard_database in shard_databases:
+        logging.warning(f"Merging {shard_database}")
+        conn = sqlite3.connect(f"file:{shard_database}?mode=ro", uri=True, timeout=10)
+        try:
+            batch = defaultdict(list)
+            pending = 0
+            for site, rows in iter_shard_sites(conn):
+                batch["site"].append((site, rows, None))
+                pending += len(rows) or 1
+                if pending >= batch_size:
+                    sql_rows += storage.write(batch)
+                    batch = defaultdict(list)
+                    pending = 0
+            sql_rows += storage.write(batch)
+
+            for table, select_stmt in (
+                (
+                    "crawl_state",
+                    "SELECT HOST, ETAG, LAST_MODIFIED, CONTENT_HASH, REFERRALS, LAST_STATUS FROM crawl_state",
+                ),
+                (
+                    "host_health",
+                    "SELECT HOST, FAILURES, LAST_SUCCESS, LAST_ATTEMPT, LATENCY, LAST_ERROR FROM host_health",
+                ),
+                (
+                    "raw_response",
+                    "SELECT HOST, CRAWLED, CONTENT_HASH, STATUS, CHARSET FROM raw_response",
+                ),
+            ):
+                cursor = conn.execute(select_stmt)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    storage.write({table: rows})
+        finally:
+            conn.close()
+    storage.close()
+
+    return sql_rows
+
+
+# end merge_shards  #####
 
-                                if len(rhs) > 0:
-                                    rhs_host = rhs[0].strip().lower()
-                                if len(rhs) > 1:
-                                    comment = rhs[1].strip()
+#################################################################
+# FUNCTION normalize_host
+#  reduce one target item (hostname or URL) to a canonical host:
+#  lowercase, punycode, no 'www.' prefix, optional ':port' kept.
+#  returns None for anything that is not a hostname, such as the
+#  header lines of the dated adstxt_domains_* lists
+#
+#################################################################
 
-                                if lhs.startswith("subdomain"):
-                                    logging.debug(f"DIRECTIVE subdomain:[{rhs_host}]")
-                                    referral_domains.append(rhs_host)
 
-                                elif lhs.startswith("contentproducerdomain"):
-                                    logging.debug(
-                                        f"DIRECTIVE contentproducerdomain [{ahost}][{rhs_host}]"
-                                    )
-                                    referral_domains.append(rhs_host)
-                                    rowcnt += process_contentdirective_row_to_db(
-                                        conn, "cd", ahost, rhs_host, comment
-                                    )
+def normalize_host(item):
+    item = item.strip().lower()
+    if not item or item.startswith("#"):
+        return None
 
-                                elif lhs.startswith("contentdistributordomain"):
-                                    logging.debug(
-                                        f"contentdistributordomain [{ahost}][{rhs_host}]"
-                                    )
-                                    referral_domains.append(rhs_host)
-                                    rowcnt += process_contentdirective_row_to_db(
-                                        conn, "cp", ahost, rhs_host, comment
-                                    )
+    if "://" in item or item.startswith(("http:", "https:")):
+        host = urlparse(item).netloc.rpartition("@")[2]
+    elif "/" in item:
+        host = urlparse("//" + item).netloc.rpartition("@")[2]
+    else:
+        host = item
 
-                        # skip row if it's not at least 3 fields
-                        if len(row) < 3:
-                            continue
+    host, sep, port = host.partition(":")
+    host = host.rstrip(".")
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            return None
+    if host.startswith("www.") and "." in host[4:]:
+        host = host[4:]
+    if sep:
+        host = f"{host}:{port}"
 
-                        if len(line) > 1 and len(line[1]) > 0:
-                            comment = line[1]
+    if host != "localhost" and not HOST_PATTERN.match(host):
+        return None
 
-                        adsystem_domain = row[0].lower().strip()
-                        adsystem_id = fetch_adsystem_id(conn, adsystem_domain)
+    return host
 
-                        if not (adsystem_id is not None and adsystem_id > 0):
-                            logging.warning(
-                                f"FIX unknown ADSYSTEM [{adsystem_domain}][{row[0]}]"
-                            )
 
-                        rowcnt += process_adstxt_row_to_db(
-                            conn, row, comment, ahost, adsystem_id
-                        )
+# end normalize_host  #####
 
-        os.remove(tmpfile)
+#################################################################
+# FUNCTION host_digest
+#  64 bit digest of a host, kept in the seen-sets instead of the
+#  host string so they stay small on the largest target lists
+#
+#################################################################
 
-    if not referral_domain:
-        for ahost in referral_domains:
-            rowcnt += crawl_to_db(ahost, referral_domain=True)
 
-    return rowcnt
+def host_digest(host):
+    return int.from_bytes(
+        hashlib.blake2b(host.encode("ascii"), digest_size=8).digest(), "little"
+    )
 
 
-# end crawl_to_db  #####
+# end host_digest  #####
 
 #################################################################
-# FUNCTION load_url_queue
-#  Load the target set of URLs and reduce to an ads.txt domains queue
+# FUNCTION read_targets
+#  lazily read the target file and yield each distinct host once
 #
 #################################################################
 
 
-def load_url_queue(csvfilename, url_queue):
-    cnt = 0
+def read_targets(csvfilename):
+    seen = set()
 
     with open(
         csvfilename, "r", newline="", encoding="utf-8"
@@ -389,93 +1835,249 @@ def load_url_queue(csvfilename, url_queue):
                 continue
 
             for item in row:
-                host = "localhost"
+                host = normalize_host(item)
+                if host is None:
+                    if item.strip():
+                        logging.debug("SKIP: %s" % item)
+                    continue
 
-                if "http:" in item or "https:" in item:
-                    logging.info("URL: %s" % item)
-                    parsed_uri = urlparse(row[0])
-                    host = parsed_uri.netloc
-                else:
-                    host = item
-                    logging.info("HOST: %s" % item)
+                digest = host_digest(host)
+                if digest in seen:
+                    continue
+                seen.add(digest)
 
-            skip = 0
+                logging.info("HOST: %s" % host)
+                yield host
 
-            try:
-                # Uncomment next line to print host
-                # print("Checking DNS: %s" % str(host))
-                ip = socket.gethostbyname(host)
-
-                if "127.0.0" in ip:
-                    skip = 0  # swap to 1 to skip localhost testing
-                elif "0.0.0.0" in ip:
-                    skip = 1
+
+# end read_targets  #####
+
+#################################################################
+# FUNCTION resolve_host
+#  resolve the bare hostname of a target, 'host:port' targets keep
+#  their port. returns (host, ip), ip is "" if it did not resolve
+#
+#################################################################
+
+
+def resolve_host(host):
+    try:
+        # Uncomment next line to print host
+        # print("Checking DNS: %s" % str(host))
+        ip = socket.gethostbyname(host.split(":")[0])
+    except:
+        ip = ""
+
+    return host, ip
+
+
+# end resolve_host  #####
+
+#################################################################
+# FUNCTION skip_host_ip
+#  1 if a target resolving to 'ip' should not be crawled
+#
+#################################################################
+
+
+def skip_host_ip(ip):
+    skip = 0
+
+    if not ip:
+        skip = 1
+    elif "127.0.0" in ip:
+        skip = 0  # swap to 1 to skip localhost testing
+    elif "0.0.0.0" in ip:
+        skip = 1
+    else:
+        logging.info("  Validated Host IP: %s" % ip)
+
+    return skip
+
+
+# end skip_host_ip  #####
+
+#################################################################
+# FUNCTION resolve_targets
+#  DNS pre-resolution stage: resolve the targets on a pool of
+#  'concurrency' threads and yield every crawlable host as soon as
+#  its lookup completes, so the crawl starts with the first answer.
+#  Lookups are cached in 'dns_cache' {name: (ip, resolved_at)} and
+#  reused for 'ttl' seconds; 'stats' counts the hosts yielded and
+#  'timings' gets the lookup duration of every yielded host.
+#
+#################################################################
+
+
+async def resolve_targets(
+    hosts, dns_cache, concurrency=64, ttl=21600, stats=None, timings=None
+):
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="adstxt_dns")
+    if stats is None:
+        stats = {}
+    stats.setdefault("hosts", 0)
+    stats.setdefault("dns_cached", 0)
+
+    if timings is None:
+        timings = {}
+
+    hosts = iter(hosts)
+    pending = {}
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            resolved = []
+            while not exhausted and len(pending) + len(resolved) < concurrency:
+                host = next(hosts, None)
+                if host is None:
+                    exhausted = True
+                    break
+
+                cached = dns_cache.get(host.split(":")[0].lower())
+                if cached and time.time() - cached[1] < ttl:
+                    stats["dns_cached"] += 1
+                    resolved.append((host, cached[0], 0.0))
                 else:
-                    logging.info("  Validated Host IP: %s" % ip)
-            except:
-                skip = 1
-
-            if skip < 1:
-                ads_txt_url = "http://{thehost}/ads.txt".format(
-                    thehost=host
-                )  # Removed the encode to utf-8
-                logging.info("  pushing %s" % ads_txt_url)
-                # url_queue[ads_txt_url] = host
-                url_queue.append(host)  # Adjusted to append the host to the queue
-                cnt += 1
+                    fut = loop.run_in_executor(pool, resolve_host, host)
+                    pending[fut] = loop.time()
+
+            if pending and not resolved:
+                done = (
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                )[0]
+                for fut in done:
+                    host, ip = fut.result()
+                    dns_cache[host.split(":")[0].lower()] = (ip, time.time())
+                    resolved.append((host, ip, loop.time() - pending.pop(fut)))
+
+            for host, ip, seconds in resolved:
+                if skip_host_ip(ip) < 1:
+                    logging.info("  pushing http://%s/ads.txt" % host)
+                    stats["hosts"] += 1
+                    timings[host] = seconds
+                    yield host
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# end resolve_targets  #####
+
+#################################################################
+# FUNCTION load_crawl_state
+#  load the validators stored by previous crawls,
+#  {HOST: (ETAG, LAST_MODIFIED, CONTENT_HASH, REFERRALS)}
+#
+#################################################################
 
-    return cnt
 
+def load_crawl_state(database):
+    select_stmt = "SELECT HOST, ETAG, LAST_MODIFIED, CONTENT_HASH, REFERRALS FROM crawl_state WHERE CONTENT_HASH != ''"
+    conn = sqlite3.connect(database, timeout=10)
+    try:
+        crawl_state = {row[0]: row[1:] for row in conn.execute(select_stmt)}
+    finally:
+        conn.close()
 
-# end load_url_queue  #####
+    return crawl_state
+
+
+# end load_crawl_state  #####
 
 #################################################################
-# FUNCTION fetch_adsystem_id
-#  fetch adsystem ID from 'adsystem_domain' table
+# FUNCTION load_host_health
+#  load the health of the hosts crawled before,
+#  {HOST: (FAILURES, LAST_SUCCESS, LAST_ATTEMPT, LATENCY)}
 #
 #################################################################
 
 
-def fetch_adsystem_id(conn, adsystem_domain):
-    select_stmt = "SELECT ID FROM adsystem_domain WHERE DOMAIN=?"
-    c = conn.cursor()
-    c.execute(select_stmt, (adsystem_domain,))
+def load_host_health(database):
+    select_stmt = "SELECT HOST, FAILURES, LAST_SUCCESS, LAST_ATTEMPT, LATENCY FROM host_health"
+    conn = sqlite3.connect(database, timeout=10)
+    try:
+        host_health = {row[0]: row[1:] for row in conn.execute(select_stmt)}
+    finally:
+        conn.close()
+
+    return host_health
+
 
-    ads_id = None
+# end load_host_health  #####
+
+#################################################################
+# FUNCTION load_dns_cache
+#  load the DNS answers of previous runs younger than 'ttl' seconds,
+#  {HOST: (IP, RESOLVED)}
+#
+#################################################################
+
+
+def load_dns_cache(database, ttl):
+    select_stmt = "SELECT HOST, IP, RESOLVED FROM dns_cache WHERE RESOLVED > ?"
+    conn = sqlite3.connect(database, timeout=10)
     try:
-        ads_id = c.fetchone()[0]
-    except TypeError:  # Most likely exception for this context
-        ads_id = None
+        dns_cache = {
+            row[0]: row[1:] for row in conn.execute(select_stmt, (time.time() - ttl,))
+        }
+    finally:
+        conn.close()
 
-    return ads_id
+    return dns_cache
 
 
-# end fetch_adsystem_id  #####
+# end load_dns_cache  #####
 
 #################################################################
-# FUNCTION update_adsystem_domain
-#  update ADSYSTEM_DOMAIN
+# FUNCTION save_dns_cache
+#  store the DNS answers resolved since 'since' for the next run
 #
 #################################################################
 
 
-def update_adsystem_domain(
-    database,
-):  # Added 'database' parameter for clarity and reusability
-    update_stmt = """UPDATE ADSTXT 
-                     SET ADSYSTEM_DOMAIN = (SELECT IFNULL(ID,0) 
-                                            FROM ADSYSTEM_DOMAIN 
-                                            WHERE ADSTXT.EXCHANGE_DOMAIN = ADSYSTEM_DOMAIN.DOMAIN) 
-                     WHERE EXISTS (SELECT * 
-                                   FROM ADSYSTEM_DOMAIN 
-                                   WHERE ADSTXT.EXCHANGE_DOMAIN = ADSYSTEM_DOMAIN.DOMAIN);"""
+def save_dns_cache(database, dns_cache, since):
+    insert_stmt = "INSERT OR REPLACE INTO dns_cache (HOST, IP, RESOLVED) VALUES (?, ?, ?);"
+    rows = [
+        (host, ip, resolved)
+        for host, (ip, resolved) in dns_cache.items()
+        if resolved >= since
+    ]
     conn = sqlite3.connect(database, timeout=10)
     with conn:
-        c = conn.cursor()
-        c.execute(update_stmt)
+        conn.executemany(insert_stmt, rows)
+    conn.close()
+
+    return len(rows)
 
 
-# end update_adsystem_domain  #####
+# end save_dns_cache  #####
+
+#################################################################
+# FUNCTION start_crawl_job
+#  hosts of crawl job 'job' already journaled as done. Unless
+#  'resume' is set the journal of the job is cleared first, so the
+#  job starts over.
+#
+#################################################################
+
+
+def start_crawl_job(database, job, resume=False):
+    conn = sqlite3.connect(database, timeout=10)
+    with conn:
+        if resume:
+            done = {
+                row[0]
+                for row in conn.execute("SELECT HOST FROM crawl_job WHERE JOB=?", (job,))
+            }
+        else:
+            conn.execute("DELETE FROM crawl_job WHERE JOB=?", (job,))
+            done = set()
+    conn.close()
+
+    return done
+
+
+# end start_crawl_job  #####
 
 #################################################################
 # FUNCTION set_log_file
@@ -526,6 +2128,23 @@ def init_database(db_name):
     except TypeError:  # Likely exception when fetchone() returns None
         cnt = 0
 
+    if cnt:
+        with conn:
+            new_history = not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'adstxt_history'"
+            ).fetchone()
+            for create_stmt in SCHEMA_UPGRADES:
+                conn.execute(create_stmt)
+            raw_columns = {row[1] for row in conn.execute("PRAGMA table_info(raw_response)")}
+            if "CHARSET" not in raw_columns:
+                # the bodies stored before were UTF-8 encoded text
+                conn.execute(
+                    "ALTER TABLE raw_response ADD COLUMN CHARSET TEXT NOT NULL DEFAULT ''"
+                )
+            if new_history:
+                # rows stored before the history was kept start at their last update
+                conn.execute(HISTORY_SEED)
+
     # Closing connection is a good practice after you're done with it
     conn.close()
 
@@ -534,106 +2153,659 @@ def init_database(db_name):
 
 # end init_database  #####
 
-#### MAIN ####
-# if __name__ == "__main__":
-# Set default values for persistent data
-crawl_url_queue = []
-cnt_urls = 0
-cnt_records = 0
-database = ""
-cnt_urls_processed = 0  # TBA
-
-arg_parser = ArgumentParser()
-arg_parser.add_argument(
-    "-t",
-    "--targets",
-    dest="target_filename",
-    help="list of domains to crawl ads.txt from",
-    metavar="FILE",
-)
-arg_parser.add_argument(
-    "-d",
-    "--database",
-    dest="target_database",
-    help="Database to dump crawled data into",
-    metavar="FILE",
-)
-arg_parser.add_argument(
-    "-v",
-    "--verbose",
-    dest="verbose",
-    action="count",
-    help="Increase verbosity (specify multiple times for more)",
-)
-arg_parser.add_argument(
-    "-p",
-    "--thread_pool",
-    dest="num_threads",
-    default=4,
-    type=int,
-    help="number of crawling threads to use",
-)
+#################################################################
+# CLASS Crawler
+#  crawls, imports and merges into one SQLite DB 'database' and the
+#  storage backend of the 'storage' URL (None for that DB itself),
+#  configured with the keyword arguments matching the command line
+#  options. It keeps no state between runs besides the DB, so a
+#  long-lived process such as a scheduler can run any number of
+#  them without paying for the interpreter startup each time.
+#  The methods return dicts of counts, "records" being the number
+#  of rows written.
+#
+#################################################################
+
 
-args = arg_parser.parse_args()
+class Crawler:
+    def __init__(
+        self,
+        database,
+        storage=None,
+        pragmas=(),
+        concurrency=64,
+        per_host=1,
+        host_delay=0.0,
+        per_ip=0,
+        ip_rate=0.0,
+        ip_burst=0.0,
+        max_redirects=5,
+        timeout=5.0,
+        retries=2,
+        retry_backoff=1.0,
+        dead_after=5,
+        dead_recheck=604800,
+        max_size=MAX_BODY_SIZE,
+        batch_size=5000,
+        adsystem_reload=0.0,
+        dns_threads=64,
+        dns_ttl=21600,
+        max_depth=1,
+        metrics_file=None,
+        progress_interval=10.0,
+        raw_store=None,
+        import_threads=4,
+    ):
+        try:
+            cnt = init_database(database)
+        except sqlite3.Error:
+            cnt = 0
+        if cnt < 1:
+            raise ValueError(f"Missing Database {database}, create it with adstxt_crawler.sql")
+
+        self.database = database
+        self.pragmas = DEFAULT_PRAGMAS + tuple(pragmas)
+        self.storage = open_storage(storage, database, self.pragmas)
+        # where the records go, without the credentials of a storage URL
+        self.destination = storage.split("@")[-1] if storage else database
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.per_ip = per_ip
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.dead_after = dead_after
+        self.dead_recheck = dead_recheck
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.adsystem_reload = adsystem_reload
+        self.dns_threads = dns_threads
+        self.dns_ttl = dns_ttl
+        self.max_depth = max_depth
+        self.metrics_file = metrics_file
+        self.progress_interval = progress_interval
+        self.raw_store = raw_store
+        self.import_threads = import_threads
+
+    # crawl the normalized 'hosts' (see read_targets). With a 'job'
+    # name the finished hosts are journaled, and skipped when
+    # 'resume' is set; 'shard' is an (index, count) pair. The marker
+    # left in 'shard_dir' is stamped with 'run_id', the job by default
+    def crawl(
+        self,
+        hosts,
+        job=None,
+        resume=False,
+        full_recrawl=False,
+        shard=None,
+        shard_dir=None,
+        run_id=None,
+    ):
+        logging.warning(f"Async Crawl {self.concurrency}")
+        adsystem_ids = self.storage.load_adsystem_ids()
+        logging.info(f"Loaded {len(adsystem_ids)} adsystem domains")
+
+        done_hosts = start_crawl_job(self.database, job, resume=resume) if job else set()
+        if done_hosts:
+            logging.warning(f"Resuming {job}, {len(done_hosts)} hosts already done")
+
+        # targets are resolved while the crawl runs and fed to it as they resolve
+        dns_started = time.time()
+        dns_cache = load_dns_cache(self.database, self.dns_ttl)
+        dns_stats = {}
+        dns_times = {}
+        crawl_stats = {}
+        host_health = load_host_health(self.database)
+        index, shards = shard or (0, 1)
+        if shards > 1:
+            logging.warning(f"Shard {index}/{shards}")
+        if run_id is None:
+            run_id = job or ""
+        # --merge must not take the marker of a previous run for this one
+        if shard_dir:
+            clear_shard_marker(shard_dir, index, shards)
+        targets = resolve_targets(
+            skip_dormant(
+                (
+                    host
+                    for host in hosts
+                    if host not in done_hosts
+                    and (shards == 1 or in_shard(host, index, shards))
+                ),
+                host_health,
+                dead_after=self.dead_after,
+                dead_recheck=self.dead_recheck,
+                stats=crawl_stats,
+            ),
+            dns_cache,
+            concurrency=self.dns_threads,
+            ttl=self.dns_ttl,
+            stats=dns_stats,
+            timings=dns_times,
+        )
+
+        records = asyncio.run(
+            crawl_async(
+                targets,
+                self.database,
+                concurrency=self.concurrency,
+                per_host=self.per_host,
+                host_delay=self.host_delay,
+                batch_size=self.batch_size,
+                pragmas=self.pragmas,
+                adsystem_ids=adsystem_ids,
+                adsystem_reload=self.adsystem_reload,
+                crawl_state={} if full_recrawl else load_crawl_state(self.database),
+                max_redirects=self.max_redirects,
+                job=job,
+                stats=crawl_stats,
+                max_depth=self.max_depth,
+                metrics_file=self.metrics_file,
+                dns_times=dns_times,
+                progress_interval=self.progress_interval,
+                host_health=host_health,
+                timeout=self.timeout,
+                retries=self.retries,
+                retry_backoff=self.retry_backoff,
+                dead_after=self.dead_after,
+                dead_recheck=self.dead_recheck,
+                raw_store=self.raw_store,
+                storage=self.storage,
+                max_size=self.max_size,
+                dns_cache=dns_cache,
+                per_ip=self.per_ip,
+                ip_rate=self.ip_rate,
+                ip_burst=self.ip_burst,
+            )
+        )
+
+        save_dns_cache(self.database, dns_cache, dns_started)
+        logging.warning(
+            f"Resolved {dns_stats['hosts']} hosts, {dns_stats['dns_cached']} from the DNS cache"
+        )
+        stats = dict(
+            crawl_stats,
+            hosts=dns_stats["hosts"],
+            dns_cached=dns_stats["dns_cached"],
+            records=records,
+        )
+
+        # an empty shard is finished too
+        if shard_dir:
+            write_shard_marker(
+                shard_dir,
+                index,
+                shards,
+                self.database,
+                {key: stats[key] for key in ("hosts", "processed", "records")},
+                run_id=run_id,
+            )
 
-# Exit with help info if no args passed
-if len(sys.argv) == 1:
-    arg_parser.print_help()
-    exit(1)
+        return stats
+
+    # load the ads.txt files of a directory, zip or tar archive
+    def import_files(self, path, full_recrawl=False):
+        if not os.path.exists(path):
+            raise ValueError(f"Missing import path {path}")
+        logging.warning(f"Import {path}")
+        return self.import_stream(iter_adstxt_files(path, self.max_size), full_recrawl)
+
+    # reparse the latest body of every host kept in the raw store
+    def replay(self):
+        if not self.raw_store:
+            raise ValueError("--replay needs the --raw_store directory")
+        logging.warning(f"Import raw store {self.raw_store}")
+        # a replay is for reparsing what is already known; the bodies are
+        # the ones the stored ETag/Last-Modified were served with, so
+        # the validators are kept (see process_fetch_result)
+        return self.import_stream(
+            iter_raw_responses(self.database, self.raw_store), full_recrawl=True
+        )
 
-print(args)
+    def import_stream(self, files, full_recrawl=False):
+        stats = {}
+        import_adstxt_files(
+            files,
+            self.database,
+            workers=self.import_threads,
+            batch_size=self.batch_size,
+            pragmas=self.pragmas,
+            stats=stats,
+            storage=self.storage,
+            reparse=full_recrawl,
+        )
+        return stats
+
+    # merge shard DBs, a directory in 'paths' stands for the shards
+    # listed in it as a --shard_dir and must hold all their markers,
+    # all of one run ('run_id' if given)
+    def merge(self, paths, run_id=None):
+        shard_databases = []
+        for path in paths:
+            if not os.path.exists(path):
+                raise ValueError(f"Missing shard DB or --shard_dir {path}")
+            if not os.path.isdir(path):
+                shard_databases.append(path)
+                continue
+            markers, missing = read_shard_markers(path, run_id)
+            if missing:
+                raise ValueError(f"Shards {', '.join(missing)} missing in {path}")
+            shard_databases.extend(marker["database"] for marker in markers)
 
-set_log_file(args.verbose)
-red_log_template = f"\033[91m{{}} \033[0m"
-green_log_template = f"\033[92m{{}} \033[0m"
+        logging.warning(f"Merge {len(shard_databases)} shards")
+        dropped = self.storage.dropped
+        records = merge_shards(shard_databases, self.storage, batch_size=self.batch_size)
+        return {
+            "shards": len(shard_databases),
+            "records": records,
+            "dropped": self.storage.dropped - dropped,
+        }
 
-# Exit with help if no DB file passed
-if args.target_database and len(args.target_database) > 1:
-    ret = init_database(args.target_database)
-    if ret < 1:
-        print(red_log_template.format("Missing Database"))
-        arg_parser.print_help()
-        exit(1)
-    database = args.target_database
-else:
-    print(red_log_template.format("Missing Database file name argument"))
-    arg_parser.print_help()
-    exit(1)
-
-# Exit with help if no target domains file passed
-if args.target_filename and len(args.target_filename) > 1:
-    cnt_urls = load_url_queue(args.target_filename, crawl_url_queue)
-else:
-    print(red_log_template.format("Missing target domains file name argument"))
-    arg_parser.print_help()
-    exit(1)
-
-if cnt_urls < 1 or not database or len(database) < 1:
-    print("No Crawl")
-    logging.warning("No Crawl")
-    exit(1)
-
-if args.num_threads > 1:
-    print(f"Thread Pool Crawl {args.num_threads}")
-    logging.warning(f"Thread Pool Crawl {args.num_threads}")
-    p = Pool(args.num_threads)  # OR multiprocessing.cpu_count()
-    records = p.map(crawl_to_db, crawl_url_queue)
-    p.close()
-    p.join()
-    cnt_records = sum(records)
-else:
-    print("Single Threaded Crawl")
-    logging.warning("Single Threaded Crawl")
-    cnt_records = 0
-    for row in crawl_url_queue:
-        cnt_records += crawl_to_db(row)
-
-print(
-    green_log_template.format(
-        f"Wrote {cnt_records} records from {cnt_urls} URLs to {args.target_database}"
+    def update_adsystem_domain(self):
+        self.storage.update_adsystem_domain()
+
+
+# end Crawler  #####
+
+#################################################################
+# FUNCTION build_arg_parser
+#  the command line options of main()
+#
+#################################################################
+
+
+def build_arg_parser():
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument(
+        "-t",
+        "--targets",
+        dest="target_filename",
+        help="list of domains to crawl ads.txt from",
+        metavar="FILE",
     )
-)
-logging.warning(
-    f"Wrote {cnt_records} records from {cnt_urls} URLs to {args.target_database}"
-)
-logging.warning("Finished crawl.")
+    arg_parser.add_argument(
+        "-d",
+        "--database",
+        dest="target_database",
+        help="Database to dump crawled data into",
+        metavar="FILE",
+    )
+    arg_parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="count",
+        help="Increase verbosity (specify multiple times for more)",
+    )
+    arg_parser.add_argument(
+        "-p",
+        "--thread_pool",
+        dest="num_threads",
+        default=64,
+        type=int,
+        help="number of concurrent ads.txt fetches",
+    )
+    arg_parser.add_argument(
+        "--per_host",
+        dest="per_host",
+        default=1,
+        type=int,
+        help="max concurrent fetches against the same host",
+    )
+    arg_parser.add_argument(
+        "--host_delay",
+        dest="host_delay",
+        default=0.0,
+        type=float,
+        help="min seconds between two fetches against the same host",
+    )
+    arg_parser.add_argument(
+        "--per_ip",
+        dest="per_ip",
+        default=0,
+        type=int,
+        help="max concurrent fetches against hosts sharing one IP (0 = no limit)",
+    )
+    arg_parser.add_argument(
+        "--ip_rate",
+        dest="ip_rate",
+        default=0.0,
+        type=float,
+        help="max fetches per second against hosts sharing one IP (0 = no limit)",
+    )
+    arg_parser.add_argument(
+        "--ip_burst",
+        dest="ip_burst",
+        default=0.0,
+        type=float,
+        help="fetches an idle IP may get at once under --ip_rate (default: one second's worth)",
+    )
+    arg_parser.add_argument(
+        "--max_redirects",
+        dest="max_redirects",
+        default=5,
+        type=int,
+        help="max redirects followed for one ads.txt",
+    )
+    arg_parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        default=5.0,
+        type=float,
+        metavar="SECONDS",
+        help="max connect/read timeout, shortened per host from its history",
+    )
+    arg_parser.add_argument(
+        "--max_size",
+        dest="max_size",
+        default=MAX_BODY_SIZE,
+        type=int,
+        metavar="BYTES",
+        help="ads.txt bodies larger than this are dropped unread",
+    )
+    arg_parser.add_argument(
+        "--retries",
+        dest="retries",
+        default=2,
+        type=int,
+        help="retries of timeouts, connection errors and 5xx/429 answers",
+    )
+    arg_parser.add_argument(
+        "--retry_backoff",
+        dest="retry_backoff",
+        default=1.0,
+        type=float,
+        metavar="SECONDS",
+        help="base of the jittered exponential wait before a retry",
+    )
+    arg_parser.add_argument(
+        "--dead_after",
+        dest="dead_after",
+        default=5,
+        type=int,
+        help="failed crawls in a row after which a host is only rechecked every --dead_recheck (0 = never)",
+    )
+    arg_parser.add_argument(
+        "--dead_recheck",
+        dest="dead_recheck",
+        default=604800,
+        type=int,
+        metavar="SECONDS",
+        help="how often dead hosts are tried again",
+    )
+    arg_parser.add_argument(
+        "--storage",
+        dest="storage",
+        metavar="URL",
+        help="write the records to this DB instead, e.g. postgresql://user@host/adstxt "
+        "(crawl state stays in --database)",
+    )
+    arg_parser.add_argument(
+        "--batch_size",
+        dest="batch_size",
+        default=5000,
+        type=int,
+        help="rows committed per DB transaction",
+    )
+    arg_parser.add_argument(
+        "--db_pragma",
+        dest="db_pragmas",
+        action="append",
+        default=[],
+        metavar="PRAGMA",
+        help="extra SQLite PRAGMA for the writer, e.g. synchronous=OFF (repeatable)",
+    )
+    arg_parser.add_argument(
+        "--adsystem_reload",
+        dest="adsystem_reload",
+        default=0.0,
+        type=float,
+        metavar="SECONDS",
+        help="re-read adsystem_domain this often during the crawl (0 = never)",
+    )
+    arg_parser.add_argument(
+        "--dns_threads",
+        dest="dns_threads",
+        default=64,
+        type=int,
+        help="number of concurrent DNS lookups",
+    )
+    arg_parser.add_argument(
+        "--dns_ttl",
+        dest="dns_ttl",
+        default=21600,
+        type=int,
+        metavar="SECONDS",
+        help="reuse DNS answers of previous runs for this long",
+    )
+    arg_parser.add_argument(
+        "--referral_depth",
+        dest="referral_depth",
+        default=1,
+        type=int,
+        help="max subdomain/content directive hops followed from a target (0 = none)",
+    )
+    arg_parser.add_argument(
+        "--metrics",
+        dest="metrics_file",
+        metavar="FILE",
+        help="append per host timings, sizes and row counts to this JSONL file",
+    )
+    arg_parser.add_argument(
+        "--progress",
+        dest="progress_interval",
+        default=10.0,
+        type=float,
+        metavar="SECONDS",
+        help="log a throughput and latency summary this often (0 = only at the end)",
+    )
+    arg_parser.add_argument(
+        "--job",
+        dest="job",
+        help="name of the crawl job in the crawl_job journal (default: the targets file path)",
+    )
+    arg_parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help="skip the hosts an interrupted run of the same job already finished",
+    )
+    arg_parser.add_argument(
+        "--full_recrawl",
+        dest="full_recrawl",
+        action="store_true",
+        help="ignore the stored crawl_state and refetch and reparse every file",
+    )
+    arg_parser.add_argument(
+        "--shard",
+        dest="shard",
+        type=parse_shard,
+        metavar="I/N",
+        help="only crawl the targets hashed to shard I (0 to N-1) of N",
+    )
+    arg_parser.add_argument(
+        "--shard_dir",
+        dest="shard_dir",
+        metavar="DIR",
+        help="shared directory where a finished --shard leaves a marker for --merge",
+    )
+    arg_parser.add_argument(
+        "--run_id",
+        dest="run_id",
+        help="run the --shard_dir markers are stamped with and --merge expects "
+        "(default: the --job), e.g. the date of a recurring crawl",
+    )
+    arg_parser.add_argument(
+        "--merge",
+        dest="merge_paths",
+        nargs="+",
+        metavar="PATH",
+        help="merge shard DBs, or the shards listed in a --shard_dir, into --database/--storage",
+    )
+    arg_parser.add_argument(
+        "--import",
+        dest="import_path",
+        metavar="PATH",
+        help="load the ads.txt files of a directory, zip or tar archive instead of crawling",
+    )
+    arg_parser.add_argument(
+        "--import_threads",
+        dest="import_threads",
+        default=4,
+        type=int,
+        help="number of parse threads of --import",
+    )
+    arg_parser.add_argument(
+        "--raw_store",
+        dest="raw_store",
+        metavar="DIR",
+        help="keep every fetched ads.txt body, compressed and deduplicated, in this directory",
+    )
+    arg_parser.add_argument(
+        "--replay",
+        dest="replay",
+        action="store_true",
+        help="reparse the latest body of every host kept in --raw_store instead of crawling",
+    )
+    arg_parser.add_argument(
+        "--update_adsystem",
+        dest="update_adsystem",
+        action="store_true",
+        help="re-map ADSYSTEM_DOMAIN of all stored adstxt rows after the crawl",
+    )
+
+    return arg_parser
+
+
+# end build_arg_parser  #####
+
+#################################################################
+# FUNCTION main
+#  the command line entry point, 'argv' defaults to sys.argv[1:].
+#  returns the exit status
+#
+#################################################################
+
+
+def main(argv=None):
+    arg_parser = build_arg_parser()
+    args = arg_parser.parse_args(argv)
+
+    # Exit with help info if no args passed
+    if not (sys.argv[1:] if argv is None else argv):
+        arg_parser.print_help()
+        return 1
+
+    print(args)
+
+    set_log_file(args.verbose)
+    red_log_template = f"\033[91m{{}} \033[0m"
+    green_log_template = f"\033[92m{{}} \033[0m"
+
+    # Exit with help if no DB file passed
+    if not args.target_database or len(args.target_database) <= 1:
+        print(red_log_template.format("Missing Database file name argument"))
+        arg_parser.print_help()
+        return 1
+
+    try:
+        crawler = Crawler(
+            args.target_database,
+            storage=args.storage,
+            pragmas=args.db_pragmas,
+            concurrency=max(1, args.num_threads),
+            per_host=max(1, args.per_host),
+            host_delay=args.host_delay,
+            per_ip=max(0, args.per_ip),
+            ip_rate=max(0.0, args.ip_rate),
+            ip_burst=max(0.0, args.ip_burst),
+            max_redirects=max(0, args.max_redirects),
+            timeout=args.timeout,
+            retries=max(0, args.retries),
+            retry_backoff=args.retry_backoff,
+            dead_after=args.dead_after,
+            dead_recheck=args.dead_recheck,
+            max_size=args.max_size,
+            batch_size=max(1, args.batch_size),
+            adsystem_reload=args.adsystem_reload,
+            dns_threads=max(1, args.dns_threads),
+            dns_ttl=args.dns_ttl,
+            max_depth=max(0, args.referral_depth),
+            metrics_file=args.metrics_file,
+            progress_interval=args.progress_interval,
+            raw_store=args.raw_store,
+            import_threads=max(1, args.import_threads),
+        )
+    except (ValueError, RuntimeError) as err:
+        print(red_log_template.format(err))
+        arg_parser.print_help()
+        return 1
+
+    if args.merge_paths:
+        try:
+            stats = crawler.merge(args.merge_paths, run_id=args.run_id)
+        except (ValueError, OSError, sqlite3.Error) as err:
+            print(red_log_template.format(err))
+            return 1
+        source = f"{stats['shards']} shards"
+    elif args.import_path or args.replay:
+        try:
+            if args.replay:
+                print(f"Import raw store {args.raw_store}")
+                stats = crawler.replay()
+            else:
+                print(f"Import {args.import_path}")
+                stats = crawler.import_files(args.import_path, args.full_recrawl)
+        except (ValueError, OSError, sqlite3.Error) as err:
+            print(red_log_template.format(err))
+            arg_parser.print_help()
+            return 1
+        source = f"{stats['files']} files"
+    else:
+        # Exit with help if no target domains file passed
+        if not args.target_filename or len(args.target_filename) <= 1:
+            print(red_log_template.format("Missing target domains file name argument"))
+            arg_parser.print_help()
+            return 1
+
+        print(f"Async Crawl {args.num_threads}")
+        stats = crawler.crawl(
+            read_targets(args.target_filename),
+            job=args.job or os.path.abspath(args.target_filename),
+            resume=args.resume,
+            full_recrawl=args.full_recrawl,
+            shard=args.shard,
+            shard_dir=args.shard_dir,
+            run_id=args.run_id,
+        )
+        if stats["hosts"] < 1:
+            print("No Crawl")
+            logging.warning("No Crawl")
+            return 1
+        source = f"{stats['hosts']} URLs"
+
+    if args.update_adsystem:
+        crawler.update_adsystem_domain()
+
+    wrote = f"Wrote {stats['records']} records from {source} to {crawler.destination}"
+    if "commit_seconds" in stats:
+        wrote += f", db write {stats['commit_seconds']:.2f}s"
+    print(green_log_template.format(wrote))
+    logging.warning(wrote)
+    if stats.get("dropped"):
+        print(red_log_template.format(f"Dropped {stats['dropped']} rows of failed DB writes"))
+        logging.error(f"Dropped {stats['dropped']} rows of failed DB writes, see the errors above")
+    if not (args.merge_paths or args.import_path or args.replay):
+        logging.warning("Finished crawl.")
+
+    return 0
+
+
+# end main  #####
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,9 @@ CREATE TABLE adstxt(
     PRIMARY KEY (SITE_DOMAIN,EXCHANGE_DOMAIN,SELLER_ACCOUNT_ID)
 );
 
+CREATE INDEX adstxt_exchange_seller ON adstxt (EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID);
+CREATE INDEX adstxt_adsystem_seller ON adstxt (ADSYSTEM_DOMAIN, SELLER_ACCOUNT_ID);
+
 DROP TABLE IF EXISTS adstxt_contentdistributor;
 
 CREATE TABLE adstxt_contentdistributor(
@@ -34,6 +37,79 @@ CREATE TABLE adstxt_contentproducer(
     PRIMARY KEY (SITE_DOMAIN,DISTRIBUTOR_DOMAIN)
 );
 
+DROP TABLE IF EXISTS crawl_state;
+
+CREATE TABLE crawl_state(
+       HOST                         TEXT    NOT NULL,
+       ETAG                         TEXT    NOT NULL DEFAULT '',
+       LAST_MODIFIED                TEXT    NOT NULL DEFAULT '',
+       CONTENT_HASH                 TEXT    NOT NULL DEFAULT '',
+       REFERRALS                    TEXT    NOT NULL DEFAULT '',
+       LAST_STATUS                  INTEGER NOT NULL DEFAULT (0),
+       UPDATED                      DATE    DEFAULT (datetime('now','utc')),
+    PRIMARY KEY (HOST)
+);
+
+DROP TABLE IF EXISTS crawl_job;
+
+CREATE TABLE crawl_job(
+       JOB                          TEXT    NOT NULL,
+       HOST                         TEXT    NOT NULL,
+       LAST_STATUS                  INTEGER NOT NULL DEFAULT (0),
+       UPDATED                      DATE    DEFAULT (datetime('now','utc')),
+    PRIMARY KEY (JOB,HOST)
+);
+
+DROP TABLE IF EXISTS dns_cache;
+
+CREATE TABLE dns_cache(
+       HOST                         TEXT    NOT NULL,
+       IP                           TEXT    NOT NULL DEFAULT '',
+       RESOLVED                     REAL    NOT NULL,
+    PRIMARY KEY (HOST)
+);
+
+DROP TABLE IF EXISTS host_health;
+
+CREATE TABLE host_health(
+       HOST                         TEXT    NOT NULL,
+       FAILURES                     INTEGER NOT NULL DEFAULT (0),
+       LAST_SUCCESS                 REAL    NOT NULL DEFAULT (0),
+       LAST_ATTEMPT                 REAL    NOT NULL DEFAULT (0),
+       LATENCY                      REAL    NOT NULL DEFAULT (0),
+       LAST_ERROR                   TEXT    NOT NULL DEFAULT '',
+    PRIMARY KEY (HOST)
+);
+
+DROP TABLE IF EXISTS raw_response;
+
+CREATE TABLE raw_response(
+       HOST                         TEXT    NOT NULL,
+       CRAWLED                      REAL    NOT NULL,
+       CONTENT_HASH                 TEXT    NOT NULL,
+       STATUS                       INTEGER NOT NULL DEFAULT (0),
+       CHARSET                      TEXT    NOT NULL DEFAULT '',
+    PRIMARY KEY (HOST,CRAWLED)
+);
+
+CREATE INDEX raw_response_hash ON raw_response (CONTENT_HASH);
+
+DROP TABLE IF EXISTS adstxt_history;
+
+CREATE TABLE adstxt_history(
+       SITE_DOMAIN                  TEXT    NOT NULL,
+       EXCHANGE_DOMAIN              TEXT    NOT NULL,
+       SELLER_ACCOUNT_ID            TEXT    NOT NULL,
+       ACCOUNT_TYPE                 TEXT    NOT NULL,
+       TAG_ID                       TEXT    NOT NULL,
+       FIRST_SEEN                   DATE    NOT NULL DEFAULT (datetime('now','utc')),
+       REMOVED                      DATE,
+    PRIMARY KEY (SITE_DOMAIN,EXCHANGE_DOMAIN,SELLER_ACCOUNT_ID,FIRST_SEEN)
+);
+
+CREATE INDEX adstxt_history_first_seen ON adstxt_history (FIRST_SEEN);
+CREATE INDEX adstxt_history_removed ON adstxt_history (REMOVED);
+
 DROP TABLE IF EXISTS adsystem_domain;
 
 CREATE TABLE "adsystem_domain" (
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+########################################################################################################
+# See README.md file
+#
+# Standalone ads.txt parser used by adstxt_crawler.py. It only turns the content of one ads.txt file into
+# records: no network, no disk and no DB access, so it can be imported and tested on its own or run in a
+# separate worker pool.
+#
+#   >>> parse_adstxt(b"green_ssp.com, 70922, DIRECT # demo\nsubdomain=blue.example.com\n")
+#   [DataRecord(line_number=1, exchange_domain='green_ssp.com', seller_account_id='70922',
+#               account_type='DIRECT', tag_id='', comment='demo'),
+#    VariableRecord(line_number=2, name='subdomain', value='blue.example.com', comment='')]
+#
+########################################################################################################
+
+import re
+from collections import namedtuple
+
+# one authorized seller line, fields are stripped but not lowercased
+DataRecord = namedtuple(
+    "DataRecord",
+    "line_number exchange_domain seller_account_id account_type tag_id comment",
+)
+
+# a <VARIABLE>=<VALUE> line such as subdomain= or contentproducerdomain=,
+# the name is lowercased
+VariableRecord = namedtuple("VariableRecord", "line_number name value comment")
+
+# a line that is neither blank, a comment, a variable nor a data record
+ErrorRecord = namedtuple("ErrorRecord", "line_number reason line")
+
+# characters dropped from ads.txt content, tabs are kept as a delimiter
+NON_PRINTABLE = re.compile("[^\t\x20-\x7E]")
+
+#################################################################
+# FUNCTION parse_line
+#  parse a single line (without its line ending) into a record,
+#  or None for blank and comment-only lines
+#
+#################################################################
+
+
+def parse_line(line, line_number=0):
+    if not line.isascii() or not line.isprintable():
+        line = NON_PRINTABLE.sub("", line)
+
+    # split on the first comment and keep what is to the left,
+    # the comment runs up to the next '#' if any
+    data, _, comment = line.partition("#")
+    comment = comment.split("#", 1)[0].strip()
+
+    if not data.strip():
+        return None
+
+    # determine delimiter, conservative = do it per line
+    fields = data.split("\t" if "\t" in data else ",")
+    if "=" in fields[0]:
+        name, _, value = data.partition("=")
+        return VariableRecord(line_number, name.strip().lower(), value.strip(), comment)
+
+    if len(fields) < 3:
+        return ErrorRecord(line_number, "missing fields", line)
+
+    return DataRecord(
+        line_number,
+        fields[0].strip(),
+        fields[1].strip(),
+        fields[2].strip(),
+        fields[3].strip() if len(fields) > 3 else "",
+        comment,
+    )
+
+
+# end parse_line  #####
+
+#################################################################
+# FUNCTION parse_lines
+#  lazily parse an iterable of lines, str or bytes, yielding one
+#  record per meaningful line
+#
+#################################################################
+
+
+def parse_lines(lines):
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "ignore")
+        record = parse_line(line.rstrip("\r\n"), line_number)
+        if record is not None:
+            yield record
+
+
+# end parse_lines  #####
+
+#################################################################
+# FUNCTION parse_adstxt
+#  parse a whole ads.txt file given as bytes, str or an iterable
+#  of lines and return the list of records
+#
+#################################################################
+
+
+def parse_adstxt(content):
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "ignore")
+    if isinstance(content, str):
+        content = content.splitlines()
+    return list(parse_lines(content))
+
+
+# end parse_adstxt  #####
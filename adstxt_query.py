@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+########################################################################################################
+# See README.md file
+#
+# Read-only queries over the adstxt table filled by adstxt_crawler.py, for seller authorization checks.
+# The SQL functions rely on the adstxt_exchange_seller and adstxt_adsystem_seller indexes, so a lookup by
+# seller does not scan the table. AuthorizationIndex loads the table once into memory for lookups in the
+# microsecond range, e.g. at bid time:
+#
+#   >>> index = load_authorization_index("adstxt.db")
+#   >>> index.lookup("blue.example.com", "green_ssp.com", "70922")
+#   'direct'
+#   >>> index.lookup_many([("blue.example.com", "green_ssp.com", "70922"), ("x.com", "y.com", "1")])
+#   ['direct', None]
+#
+# The adstxt_history intervals give the authorizations of a site as of any date and what changed between
+# two dates.
+#
+# Run it to query a DB from the shell or to compare the latencies of the SQL and in-memory lookups:
+#
+#   $ ./adstxt_query.py -d adstxt.db --seller green_ssp.com 70922
+#   $ ./adstxt_query.py -d adstxt.db --site blue.example.com --as_of 2018-02-13
+#   $ ./adstxt_query.py -d adstxt.db --changes 2018-02-13 2018-03-13
+#   $ ./adstxt_query.py -d adstxt.db --bench 100000
+#
+########################################################################################################
+
+import sys
+import time
+import random
+import sqlite3
+from argparse import ArgumentParser
+
+# (site, exchange, seller) keys per statement of a batch lookup, 3
+# bind parameters each stays below the default SQLite limit of 999
+BATCH_KEYS = 300
+
+#################################################################
+# FUNCTION open_query_db
+#  read-only connection to the SQLite DB of the crawler
+#
+#################################################################
+
+
+def open_query_db(database):
+    return sqlite3.connect(f"file:{database}?mode=ro", uri=True, check_same_thread=False)
+
+
+# end open_query_db  #####
+
+#################################################################
+# FUNCTION sites_for_seller / sites_for_adsystem / sellers_for_site
+#  the adstxt rows naming a seller account on an exchange domain or
+#  on any domain of an adsystem ID, and the sellers listed by a site.
+#  Values are compared lowercased, as the crawler stores them.
+#  return lists of tuples
+#
+#################################################################
+
+
+def sites_for_seller(conn, exchange_domain, seller_account_id):
+    return conn.execute(
+        "SELECT SITE_DOMAIN, ACCOUNT_TYPE FROM adstxt "
+        "WHERE EXCHANGE_DOMAIN = ? AND SELLER_ACCOUNT_ID = ? ORDER BY SITE_DOMAIN",
+        (exchange_domain.lower(), seller_account_id.lower()),
+    ).fetchall()
+
+
+def sites_for_adsystem(conn, adsystem_id, seller_account_id):
+    return conn.execute(
+        "SELECT SITE_DOMAIN, EXCHANGE_DOMAIN, ACCOUNT_TYPE FROM adstxt "
+        "WHERE ADSYSTEM_DOMAIN = ? AND SELLER_ACCOUNT_ID = ? ORDER BY SITE_DOMAIN",
+        (adsystem_id, seller_account_id.lower()),
+    ).fetchall()
+
+
+def sellers_for_site(conn, site_domain):
+    return conn.execute(
+        "SELECT EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE FROM adstxt "
+        "WHERE SITE_DOMAIN = ? ORDER BY EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID",
+        (site_domain.lower(),),
+    ).fetchall()
+
+
+# end sites_for_seller / sites_for_adsystem / sellers_for_site  #####
+
+#################################################################
+# FUNCTION sellers_as_of / changes_between
+#  time travel over adstxt_history. Dates are UTC 'YYYY-MM-DD' (the
+#  start of that day) or 'YYYY-MM-DD HH:MM:SS' strings.
+#  sellers_as_of returns the (site, exchange, seller, account type,
+#  tag id) rows listed at 'when', of one site or of all of them.
+#  changes_between returns the ("added" or "removed", time, site,
+#  exchange, seller, account type, tag id) rows of the changes made
+#  after 'start' and up to 'end', in time order; a changed account
+#  type or tag id is a removal and an addition.
+#
+#################################################################
+
+
+def sellers_as_of(conn, when, site_domain=None):
+    select_stmt = (
+        "SELECT SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE, TAG_ID "
+        "FROM adstxt_history WHERE FIRST_SEEN <= ? AND (REMOVED IS NULL OR REMOVED > ?)"
+    )
+    if site_domain is None:
+        return conn.execute(select_stmt, (when, when)).fetchall()
+
+    return conn.execute(
+        select_stmt + " AND SITE_DOMAIN = ? ORDER BY EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID",
+        (when, when, site_domain.lower()),
+    ).fetchall()
+
+
+def changes_between(conn, start, end, site_domain=None):
+    columns = "SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE, TAG_ID"
+    site_filter = "" if site_domain is None else " AND SITE_DOMAIN = ?"
+    site_args = () if site_domain is None else (site_domain.lower(),)
+    return conn.execute(
+        f"SELECT 'added', FIRST_SEEN, {columns} FROM adstxt_history "
+        f"WHERE FIRST_SEEN > ? AND FIRST_SEEN <= ?{site_filter} "
+        "UNION ALL "
+        f"SELECT 'removed', REMOVED, {columns} FROM adstxt_history "
+        f"WHERE REMOVED > ? AND REMOVED <= ?{site_filter} "
+        "ORDER BY 2, 1 DESC",
+        (start, end, *site_args, start, end, *site_args),
+    ).fetchall()
+
+
+# end sellers_as_of / changes_between  #####
+
+#################################################################
+# FUNCTION lookup_stmt / lookup_account_types
+#  batch lookup of (site, exchange, seller) keys on the primary key
+#  of adstxt, BATCH_KEYS keys per statement. The keys are a VALUES
+#  table driving the join (CROSS JOIN fixes the order), so every key
+#  is an index seek: a row value IN (VALUES ...) test would scan the
+#  whole index instead.
+#  returns the ACCOUNT_TYPE of every key, None when not authorized
+#
+#################################################################
+
+
+def lookup_stmt(num_keys):
+    values = ", ".join(["(?, ?, ?)"] * num_keys)
+    return (
+        f"WITH k(SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID) AS (VALUES {values}) "
+        "SELECT a.SITE_DOMAIN, a.EXCHANGE_DOMAIN, a.SELLER_ACCOUNT_ID, a.ACCOUNT_TYPE "
+        "FROM k CROSS JOIN adstxt a "
+        "ON a.SITE_DOMAIN = k.SITE_DOMAIN AND a.EXCHANGE_DOMAIN = k.EXCHANGE_DOMAIN "
+        "AND a.SELLER_ACCOUNT_ID = k.SELLER_ACCOUNT_ID"
+    )
+
+
+def lookup_account_types(conn, keys):
+    keys = [tuple(value.lower() for value in key) for key in keys]
+    found = {}
+    for start in range(0, len(keys), BATCH_KEYS):
+        chunk = keys[start : start + BATCH_KEYS]
+        for site, exchange, seller, account_type in conn.execute(
+            lookup_stmt(len(chunk)), [value for key in chunk for value in key]
+        ):
+            found[(site, exchange, seller)] = account_type
+
+    return [found.get(key) for key in keys]
+
+
+# end lookup_stmt / lookup_account_types  #####
+
+#################################################################
+# CLASS AuthorizationIndex
+#  in-memory copy of the authorized sellers: a hash index on
+#  (exchange, seller) holding {site: account type}, so a check is
+#  two dict probes. All strings are interned, a domain or account
+#  type is stored once however many rows name it.
+#
+#################################################################
+
+
+class AuthorizationIndex:
+    def __init__(self, rows=()):
+        self.sellers = {}
+        self.size = 0
+        for site, exchange, seller, account_type in rows:
+            self.add(site, exchange, seller, account_type)
+
+    def add(self, site, exchange, seller, account_type):
+        key = (sys.intern(exchange), sys.intern(seller))
+        sites = self.sellers.get(key)
+        if sites is None:
+            sites = self.sellers[key] = {}
+        if site not in sites:
+            self.size += 1
+        sites[sys.intern(site)] = sys.intern(account_type)
+
+    def __len__(self):
+        return self.size
+
+    # ACCOUNT_TYPE of the row, None when the site does not list the seller
+    def lookup(self, site, exchange, seller):
+        sites = self.sellers.get((exchange.lower(), seller.lower()))
+        return None if sites is None else sites.get(site.lower())
+
+    def lookup_many(self, keys):
+        return [self.lookup(*key) for key in keys]
+
+    # {site: account type} of every site listing the seller
+    def sites(self, exchange, seller):
+        return dict(self.sellers.get((exchange.lower(), seller.lower()), ()))
+
+
+# end AuthorizationIndex  #####
+
+#################################################################
+# FUNCTION load_authorization_index
+#  read the adstxt table of 'database' into an AuthorizationIndex
+#
+#################################################################
+
+
+def load_authorization_index(database):
+    conn = open_query_db(database)
+    try:
+        return AuthorizationIndex(
+            conn.execute(
+                "SELECT SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE FROM adstxt"
+            )
+        )
+    finally:
+        conn.close()
+
+
+# end load_authorization_index  #####
+
+#################################################################
+# FUNCTION bench_lookups
+#  time 'num_lookups' checks of keys sampled from the DB, half of
+#  them existing rows and half unknown sellers, with the SQL point
+#  and batch lookups and with an AuthorizationIndex.
+#  returns {name: (p50, p99, mean) in microseconds}, plus the index
+#  load time in seconds under "load"
+#
+#################################################################
+
+
+def bench_lookups(database, num_lookups=100000, batch_size=100):
+    conn = open_query_db(database)
+    rows = conn.execute(
+        "SELECT SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID FROM adstxt"
+    ).fetchall()
+    if not rows:
+        raise ValueError(f"no adstxt rows in {database}")
+    rnd = random.Random(0)
+    keys = []
+    for _ in range(num_lookups):
+        site, exchange, seller = rnd.choice(rows)
+        keys.append((site, exchange, seller if rnd.random() < 0.5 else seller + "-x"))
+
+    start = time.perf_counter()
+    index = load_authorization_index(database)
+    load = time.perf_counter() - start
+
+    def timed(lookup, batches):
+        durations = []
+        for batch in batches:
+            start = time.perf_counter()
+            lookup(batch)
+            durations.append((time.perf_counter() - start) / len(batch) * 1e6)
+        durations.sort()
+        return (
+            durations[len(durations) // 2],
+            durations[min(len(durations) - 1, len(durations) * 99 // 100)],
+            sum(durations) / len(durations),
+        )
+
+    singles = [[key] for key in keys]
+    batches = [keys[i : i + batch_size] for i in range(0, len(keys), batch_size)]
+    results = {
+        "sql": timed(lambda batch: lookup_account_types(conn, batch), singles),
+        f"sql batch of {batch_size}": timed(
+            lambda batch: lookup_account_types(conn, batch), batches
+        ),
+        "memory": timed(lambda batch: index.lookup(*batch[0]), singles),
+        f"memory batch of {batch_size}": timed(index.lookup_many, batches),
+        "load": load,
+    }
+    conn.close()
+
+    return results
+
+
+# end bench_lookups  #####
+
+#################################################################
+# FUNCTION main
+#  the command line entry point, see the header of this file
+#
+#################################################################
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument(
+        "-d", "--database", dest="database", required=True,
+        help="SQLite DB written by adstxt_crawler.py",
+    )
+    arg_parser.add_argument(
+        "--seller", dest="seller", nargs=2, metavar=("EXCHANGE", "SELLER"),
+        help="list the sites authorizing a seller account on an exchange",
+    )
+    arg_parser.add_argument(
+        "--adsystem", dest="adsystem", nargs=2, metavar=("ID", "SELLER"),
+        help="list the sites authorizing a seller account on any domain of an adsystem",
+    )
+    arg_parser.add_argument(
+        "--site", dest="site", help="list the sellers authorized by a site",
+    )
+    arg_parser.add_argument(
+        "--as_of", dest="as_of", metavar="DATE",
+        help="list the sellers of --site, or of all sites, as of this UTC date",
+    )
+    arg_parser.add_argument(
+        "--changes", dest="changes", nargs=2, metavar=("START", "END"),
+        help="list the sellers added and removed between two UTC dates, of --site only if given",
+    )
+    arg_parser.add_argument(
+        "--bench", dest="bench", type=int, metavar="NUM_LOOKUPS",
+        help="time this many lookups of sampled keys",
+    )
+    arg_parser.add_argument(
+        "--bench_batch", dest="bench_batch", default=100, type=int,
+        help="keys per batch lookup of --bench",
+    )
+    args = arg_parser.parse_args(argv)
+
+    conn = open_query_db(args.database)
+    if args.seller:
+        for row in sites_for_seller(conn, *args.seller):
+            print("|".join(str(value) for value in row))
+    if args.adsystem:
+        for row in sites_for_adsystem(conn, int(args.adsystem[0]), args.adsystem[1]):
+            print("|".join(str(value) for value in row))
+    if args.as_of:
+        for row in sellers_as_of(conn, args.as_of, args.site):
+            print("|".join(str(value) for value in row))
+    elif args.site and not args.changes:
+        for row in sellers_for_site(conn, args.site):
+            print("|".join(str(value) for value in row))
+    if args.changes:
+        for row in changes_between(conn, *args.changes, args.site):
+            print("|".join(str(value) for value in row))
+    conn.close()
+
+    if args.bench:
+        bench = bench_lookups(args.database, args.bench, max(1, args.bench_batch))
+        print(f"index loaded in {bench.pop('load'):.2f}s")
+        print(f"{'lookup':>20} {'p50 us':>9} {'p99 us':>9} {'mean us':>9}")
+        for name, (p50, p99, mean) in bench.items():
+            print(f"{name:>20} {p50:>9.2f} {p99:>9.2f} {mean:>9.2f}")
+
+
+# end main  #####
+
+if __name__ == "__main__":
+    main()
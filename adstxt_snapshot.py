@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+########################################################################################################
+# See README.md file
+#
+# Bulk snapshots of the site content tables of adstxt_crawler.py (adstxt, adstxt_contentdistributor and
+# adstxt_contentproducer) and of the adstxt_history change log. A snapshot is a directory with one file
+# per table and a snapshot.json manifest. The tables are streamed in chunks of 'chunk_rows' rows in both
+# directions, so memory does not grow with the size of the DB. Formats:
+#
+#   parquet  dictionary-encoded, zstd compressed columns, one row group per chunk (needs pyarrow)
+#   jsonl    one gzipped JSON object per row
+#   csv      gzipped CSV with a header line
+#
+#   $ ./adstxt_snapshot.py export -d adstxt.db -s snapshot_2018-02-13 --format parquet
+#   $ ./adstxt_snapshot.py load -d copy.db -s snapshot_2018-02-13
+#
+########################################################################################################
+
+import os
+import csv
+import gzip
+import json
+import time
+import sqlite3
+import logging
+from argparse import ArgumentParser
+from adstxt_storage import HISTORY_COLUMNS, SITE_TABLES
+
+SNAPSHOT_FORMATS = {
+    "parquet": ".parquet",
+    "jsonl": ".jsonl.gz",
+    "csv": ".csv.gz",
+}
+
+MANIFEST = "snapshot.json"
+
+# the site tables and their columns, UPDATED is kept as stored
+SNAPSHOT_TABLES = {
+    table: columns + ("UPDATED",) for table, columns, key in SITE_TABLES.values()
+}
+SNAPSHOT_TABLES["adstxt_history"] = (
+    "SITE_DOMAIN",
+    "EXCHANGE_DOMAIN",
+    "SELLER_ACCOUNT_ID",
+) + HISTORY_COLUMNS + ("FIRST_SEEN", "REMOVED")
+
+# every other column is TEXT
+INTEGER_COLUMNS = frozenset(("ADSYSTEM_DOMAIN",))
+
+# written as an empty field in CSV
+NULLABLE_COLUMNS = frozenset(("REMOVED",))
+
+#################################################################
+# FUNCTION import_pyarrow
+#  pyarrow is only needed for the parquet format, and is slow to
+#  import, so it is loaded on first use
+#
+#################################################################
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("the parquet format needs the pyarrow package")
+
+    return pyarrow
+
+
+# end import_pyarrow  #####
+
+#################################################################
+# FUNCTION write_parquet / write_jsonl / write_csv
+#  write the row 'chunks' (lists of tuples in 'columns' order) of
+#  one table to 'path'
+#
+#################################################################
+
+
+def write_parquet(path, columns, chunks):
+    pyarrow = import_pyarrow()
+    schema = pyarrow.schema(
+        [
+            (c, pyarrow.int64() if c in INTEGER_COLUMNS else pyarrow.string())
+            for c in columns
+        ]
+    )
+    with pyarrow.parquet.ParquetWriter(
+        path, schema, compression="zstd", use_dictionary=True
+    ) as writer:
+        for chunk in chunks:
+            arrays = [
+                pyarrow.array(values, type=field.type)
+                for values, field in zip(zip(*chunk), schema)
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+
+
+def write_jsonl(path, columns, chunks):
+    with gzip.open(path, "wt", compresslevel=6, encoding="utf-8") as f:
+        for chunk in chunks:
+            f.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in chunk)
+
+
+def write_csv(path, columns, chunks):
+    with gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+
+
+# end write_parquet / write_jsonl / write_csv  #####
+
+#################################################################
+# FUNCTION read_parquet / read_jsonl / read_csv
+#  lazily yield the rows of one table file as lists of tuples in
+#  'columns' order, 'chunk_rows' at a time
+#
+#################################################################
+
+
+def read_parquet(path, columns, chunk_rows=100000):
+    pyarrow = import_pyarrow()
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=list(columns)):
+        yield list(zip(*(batch.column(c).to_pylist() for c in columns)))
+
+
+def read_jsonl(path, columns, chunk_rows=100000):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        chunk = []
+        for line in f:
+            record = json.loads(line)
+            chunk.append(tuple(record[c] for c in columns))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def read_csv(path, columns, chunk_rows=100000):
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        positions = [header.index(c) for c in columns]
+        types = []
+        for c in columns:
+            if c in INTEGER_COLUMNS:
+                types.append(int)
+            elif c in NULLABLE_COLUMNS:
+                types.append(lambda value: value or None)
+            else:
+                types.append(str)
+        chunk = []
+        for record in reader:
+            chunk.append(tuple(to_type(record[i]) for i, to_type in zip(positions, types)))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# end read_parquet / read_jsonl / read_csv  #####
+
+SNAPSHOT_WRITERS = {"parquet": write_parquet, "jsonl": write_jsonl, "csv": write_csv}
+SNAPSHOT_READERS = {"parquet": read_parquet, "jsonl": read_jsonl, "csv": read_csv}
+
+#################################################################
+# FUNCTION export_snapshot
+#  stream the site tables of 'database' into the snapshot directory
+#  'directory' in 'fmt' (see SNAPSHOT_FORMATS). All tables are read
+#  in one transaction, so a crawl writing to the DB meanwhile does
+#  not leave them inconsistent.
+#  returns {table: number of rows exported}
+#
+#################################################################
+
+
+def export_snapshot(database, directory, fmt="parquet", chunk_rows=100000):
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"unknown snapshot format {fmt}")
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    manifest = {"format": fmt, "created": time.time(), "tables": {}}
+
+    conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True, timeout=10)
+    try:
+        conn.execute("BEGIN")
+        for table, columns in SNAPSHOT_TABLES.items():
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} ORDER BY SITE_DOMAIN"
+            )
+
+            def chunks():
+                while True:
+                    chunk = cursor.fetchmany(chunk_rows)
+                    if not chunk:
+                        break
+                    counts[table] += len(chunk)
+                    yield chunk
+
+            counts[table] = 0
+            file_name = table + SNAPSHOT_FORMATS[fmt]
+            SNAPSHOT_WRITERS[fmt](os.path.join(directory, file_name), columns, chunks())
+            manifest["tables"][table] = {
+                "file": file_name,
+                "columns": list(columns),
+                "rows": counts[table],
+            }
+            logging.info(f"exported {counts[table]} {table} rows")
+    finally:
+        conn.close()
+
+    # written last, a snapshot without it is incomplete
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+    return counts
+
+
+# end export_snapshot  #####
+
+#################################################################
+# FUNCTION load_snapshot
+#  replace the content of the site tables of 'database' with the
+#  snapshot in 'directory', in one transaction. The tables must
+#  exist (see adstxt_crawler.sql); the UPDATED dates are kept. The
+#  secondary indexes are dropped during the load and rebuilt in one
+#  pass at the end, which is much faster than updating them row by
+#  row.
+#  returns {table: number of rows loaded}
+#
+#################################################################
+
+
+def load_snapshot(database, directory, chunk_rows=100000):
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    fmt = manifest["format"]
+    if fmt not in SNAPSHOT_READERS:
+        raise ValueError(f"unknown snapshot format {fmt}")
+
+    counts = {}
+    # sqlite3 would autocommit the DROP INDEX statements, the
+    # transaction is managed explicitly so they are undone with the
+    # rows when the load fails
+    conn = sqlite3.connect(database, timeout=10, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        try:
+            for table, entry in manifest["tables"].items():
+                if table not in SNAPSHOT_TABLES:
+                    raise ValueError(f"unknown table {table} in {directory}")
+                columns = SNAPSHOT_TABLES[table]
+                insert_stmt = (
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * len(columns))})"
+                )
+                indexes = conn.execute(
+                    "SELECT name, sql FROM sqlite_master "
+                    "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                    (table,),
+                ).fetchall()
+                for name, create_stmt in indexes:
+                    conn.execute(f"DROP INDEX {name}")
+                conn.execute(f"DELETE FROM {table}")
+                counts[table] = 0
+                for chunk in SNAPSHOT_READERS[fmt](
+                    os.path.join(directory, entry["file"]), columns, chunk_rows
+                ):
+                    conn.executemany(insert_stmt, chunk)
+                    counts[table] += len(chunk)
+                if counts[table] != entry["rows"]:
+                    raise ValueError(
+                        f"{entry['file']} holds {counts[table]} rows, {entry['rows']} expected"
+                    )
+                for name, create_stmt in indexes:
+                    conn.execute(create_stmt)
+                logging.info(f"loaded {counts[table]} {table} rows")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    return counts
+
+
+# end load_snapshot  #####
+
+#################################################################
+# FUNCTION main
+#  the command line entry point, see the header of this file
+#
+#################################################################
+
+
+def main(argv=None):
+    arg_parser = ArgumentParser()
+    arg_parser.add_argument("command", choices=("export", "load"))
+    arg_parser.add_argument(
+        "-d", "--database", dest="database", required=True,
+        help="SQLite DB to export from or to load into",
+    )
+    arg_parser.add_argument(
+        "-s", "--snapshot", dest="snapshot", required=True,
+        help="snapshot directory",
+    )
+    arg_parser.add_argument(
+        "--format", dest="fmt", default="parquet", choices=tuple(SNAPSHOT_FORMATS),
+        help="file format of export",
+    )
+    arg_parser.add_argument(
+        "--chunk_rows", dest="chunk_rows", default=100000, type=int,
+        help="rows read and written at a time",
+    )
+    args = arg_parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "export":
+        counts = export_snapshot(
+            args.database, args.snapshot, args.fmt, max(1, args.chunk_rows)
+        )
+    else:
+        counts = load_snapshot(args.database, args.snapshot, max(1, args.chunk_rows))
+    for table, rows in counts.items():
+        print(f"{table}: {rows} rows")
+    print(f"{args.command} took {time.perf_counter() - start:.2f}s")
+
+
+# end main  #####
+
+if __name__ == "__main__":
+    main()
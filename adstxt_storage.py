@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+
+########################################################################################################
+# See README.md file
+#
+# Storage backends of adstxt_crawler.py. A backend takes the batches of rows queued for the DB writer
+# thread and owns the site content tables (adstxt, adstxt_contentdistributor, adstxt_contentproducer), the
+# adstxt_history change log and adsystem_domain. Both backends provide the same methods:
+#
+#   write(batch)              commit one batch, returns the number of site rows changed
+#   load_adsystem_ids()       read-only {DOMAIN: ID} mapping used by the parsers
+#   update_adsystem_domain()  re-map ADSYSTEM_DOMAIN of the stored adstxt rows
+#   close()                   close the connection of the writer thread
+#
+# A batch that fails to commit is logged and dropped, its rows are counted in the 'dropped' attribute.
+#
+# SQLiteStorage keeps everything in the crawler's SQLite DB. PostgresStorage bulk loads the site content
+# with COPY into staging tables and merges it into a PostgreSQL DB that several crawler nodes can write to
+# at the same time; each node keeps its crawl bookkeeping in its own SQLite DB.
+#
+########################################################################################################
+
+import sqlite3
+import logging
+from types import MappingProxyType
+
+# only needed for PostgresStorage, imported by its constructor
+psycopg = None
+
+# rows queued for the DB writer are (table key, bind values) pairs.
+# The parsed content of a site is queued as a single
+# ("site", (SITE_DOMAIN, [(site table key, bind values), ...], crawl_state))
+# item and diffed against the stored rows, see write_site. Its
+# crawl_state bind values (or None) are committed together with the
+# content, so a dropped batch never leaves a CONTENT_HASH behind for
+# content that was not stored.
+INSERT_STMTS = {
+    "crawl_job": "INSERT OR REPLACE INTO crawl_job (JOB, HOST, LAST_STATUS) VALUES (?, ?, ?);",
+    "crawl_state": "INSERT OR REPLACE INTO crawl_state (HOST, ETAG, LAST_MODIFIED, CONTENT_HASH, REFERRALS, LAST_STATUS) VALUES (?, ?, ?, ?, ?, ?);",
+    "host_health": "INSERT OR REPLACE INTO host_health (HOST, FAILURES, LAST_SUCCESS, LAST_ATTEMPT, LATENCY, LAST_ERROR) VALUES (?, ?, ?, ?, ?, ?);",
+    "raw_response": "INSERT OR REPLACE INTO raw_response (HOST, CRAWLED, CONTENT_HASH, STATUS, CHARSET) VALUES (?, ?, ?, ?, ?);",
+}
+
+# tables holding the content of a site: table name, columns of the
+# queued rows (SITE_DOMAIN first) and the primary key within a site
+SITE_TABLES = {
+    "adstxt": (
+        "adstxt",
+        (
+            "SITE_DOMAIN",
+            "EXCHANGE_DOMAIN",
+            "ADSYSTEM_DOMAIN",
+            "SELLER_ACCOUNT_ID",
+            "ACCOUNT_TYPE",
+            "TAG_ID",
+            "ENTRY_COMMENT",
+        ),
+        ("EXCHANGE_DOMAIN", "SELLER_ACCOUNT_ID"),
+    ),
+    "cd": (
+        "adstxt_contentdistributor",
+        ("SITE_DOMAIN", "PRODUCER_DOMAIN", "ENTRY_COMMENT"),
+        ("PRODUCER_DOMAIN",),
+    ),
+    "cp": (
+        "adstxt_contentproducer",
+        ("SITE_DOMAIN", "DISTRIBUTOR_DOMAIN", "ENTRY_COMMENT"),
+        ("DISTRIBUTOR_DOMAIN",),
+    ),
+}
+
+# every version of an adstxt row is kept in adstxt_history as an
+# interval: FIRST_SEEN when it was first written, REMOVED when it was
+# deleted or replaced by another version (NULL while it is stored).
+# A change of one of the HISTORY_COLUMNS starts a new version.
+HISTORY_COLUMNS = ("ACCOUNT_TYPE", "TAG_ID")
+
+# rows stored before adstxt_history existed start at their UPDATED
+HISTORY_SEED = """INSERT INTO adstxt_history
+                  (SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE, TAG_ID, FIRST_SEEN)
+                  SELECT SITE_DOMAIN, EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID, ACCOUNT_TYPE, TAG_ID, UPDATED
+                  FROM adstxt"""
+
+# the tables of PostgresStorage, same layout as adstxt_crawler.sql
+PG_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS adstxt(
+           SITE_DOMAIN                  TEXT    NOT NULL,
+           EXCHANGE_DOMAIN              TEXT    NOT NULL,
+           ADSYSTEM_DOMAIN              INTEGER NOT NULL DEFAULT (0),
+           SELLER_ACCOUNT_ID            TEXT    NOT NULL,
+           ACCOUNT_TYPE                 TEXT    NOT NULL,
+           TAG_ID                       TEXT    NOT NULL,
+           ENTRY_COMMENT                TEXT    NOT NULL,
+           UPDATED                      TIMESTAMP DEFAULT (now() at time zone 'utc'),
+        PRIMARY KEY (SITE_DOMAIN,EXCHANGE_DOMAIN,SELLER_ACCOUNT_ID)
+    );""",
+    "CREATE INDEX IF NOT EXISTS adstxt_exchange_seller ON adstxt (EXCHANGE_DOMAIN, SELLER_ACCOUNT_ID);",
+    "CREATE INDEX IF NOT EXISTS adstxt_adsystem_seller ON adstxt (ADSYSTEM_DOMAIN, SELLER_ACCOUNT_ID);",
+    """CREATE TABLE IF NOT EXISTS adstxt_contentdistributor(
+           SITE_DOMAIN                  TEXT    NOT NULL,
+           PRODUCER_DOMAIN              TEXT    NOT NULL,
+           ENTRY_COMMENT                TEXT    NOT NULL,
+           UPDATED                      TIMESTAMP DEFAULT (now() at time zone 'utc'),
+        PRIMARY KEY (SITE_DOMAIN,PRODUCER_DOMAIN)
+    );""",
+    """CREATE TABLE IF NOT EXISTS adstxt_contentproducer(
+           SITE_DOMAIN                  TEXT    NOT NULL,
+           DISTRIBUTOR_DOMAIN           TEXT    NOT NULL,
+           ENTRY_COMMENT                TEXT    NOT NULL,
+           UPDATED                      TIMESTAMP DEFAULT (now() at time zone 'utc'),
+        PRIMARY KEY (SITE_DOMAIN,DISTRIBUTOR_DOMAIN)
+    );""",
+    """CREATE TABLE IF NOT EXISTS adsystem_domain(
+           DOMAIN                       TEXT    NOT NULL,
+           ID                           INTEGER NOT NULL,
+        PRIMARY KEY (DOMAIN,ID)
+    );""",
+    """CREATE TABLE IF NOT EXISTS adstxt_history(
+           SITE_DOMAIN                  TEXT    NOT NULL,
+           EXCHANGE_DOMAIN              TEXT    NOT NULL,
+           SELLER_ACCOUNT_ID            TEXT    NOT NULL,
+           ACCOUNT_TYPE                 TEXT    NOT NULL,
+           TAG_ID                       TEXT    NOT NULL,
+           FIRST_SEEN                   TIMESTAMP NOT NULL DEFAULT (now() at time zone 'utc'),
+           REMOVED                      TIMESTAMP,
+        PRIMARY KEY (SITE_DOMAIN,EXCHANGE_DOMAIN,SELLER_ACCOUNT_ID,FIRST_SEEN)
+    );""",
+    "CREATE INDEX IF NOT EXISTS adstxt_history_first_seen ON adstxt_history (FIRST_SEEN);",
+    "CREATE INDEX IF NOT EXISTS adstxt_history_removed ON adstxt_history (REMOVED);",
+)
+
+#################################################################
+# FUNCTION open_db
+#  connect to the DB and apply the PRAGMA settings
+#
+#################################################################
+
+
+def open_db(database, pragmas=()):
+    conn = sqlite3.connect(database, timeout=10)
+    for pragma in pragmas:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
+
+
+# end open_db  #####
+
+#################################################################
+# FUNCTION site_rows
+#  split the queued rows of one site per table, as
+#  {table key: {primary key values: other column values}}; a key
+#  listed twice keeps its last line, as INSERT OR REPLACE did
+#
+#################################################################
+
+
+def site_rows(rows):
+    by_table = {table_key: {} for table_key in SITE_TABLES}
+    for table_key, row in rows:
+        columns, key = SITE_TABLES[table_key][1:]
+        by_table[table_key][tuple(row[columns.index(c)] for c in key)] = tuple(
+            row[i] for i, c in enumerate(columns[1:], 1) if c not in key
+        )
+
+    return by_table
+
+
+# end site_rows  #####
+
+#################################################################
+# FUNCTION write_site
+#  bring the stored content of one site in line with its newly
+#  parsed rows: insert the new entries, update the ones whose other
+#  columns changed and delete the ones no longer listed, leaving
+#  identical rows untouched. Must run inside a transaction.
+#  returns the number of rows inserted, updated and deleted
+#
+#################################################################
+
+
+def write_site(conn, site, rows):
+    sql_rows = 0
+    for table_key, new in site_rows(rows).items():
+        table, columns, key = SITE_TABLES[table_key]
+        values = tuple(c for c in columns[1:] if c not in key)
+
+        select_stmt = f"SELECT {', '.join(key + values)} FROM {table} WHERE SITE_DOMAIN=?"
+        old = {row[: len(key)]: row[len(key) :] for row in conn.execute(select_stmt, (site,))}
+
+        where = " AND ".join(f"{c}=?" for c in ("SITE_DOMAIN",) + key)
+        deletes = [(site, *k) for k in old.keys() - new.keys()]
+        updates = [(*v, site, *k) for k, v in new.items() if k in old and old[k] != v]
+        inserts = [(site, *k, *v) for k, v in new.items() if k not in old]
+        if deletes:
+            conn.executemany(f"DELETE FROM {table} WHERE {where}", deletes)
+        if updates:
+            conn.executemany(
+                f"UPDATE {table} SET {', '.join(f'{c}=?' for c in values)}, "
+                f"UPDATED=datetime('now','utc') WHERE {where}",
+                updates,
+            )
+        if inserts:
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(('SITE_DOMAIN',) + key + values)}) "
+                f"VALUES ({', '.join('?' * len(columns))})",
+                inserts,
+            )
+        sql_rows += len(deletes) + len(updates) + len(inserts)
+        if table_key == "adstxt":
+            write_history(conn, site, old, new, key, values)
+
+    return sql_rows
+
+
+# end write_site  #####
+
+#################################################################
+# FUNCTION write_history
+#  close the adstxt_history intervals of the rows of a site that
+#  were deleted or changed version and open one for every new
+#  version, 'old' and 'new' are the stored and the new rows of the
+#  site as compared by write_site
+#
+#################################################################
+
+
+def write_history(conn, site, old, new, key, values):
+    positions = [values.index(c) for c in HISTORY_COLUMNS]
+
+    def version(row):
+        return tuple(row[i] for i in positions)
+
+    opened = []
+    closed = [(site, *k) for k in old.keys() - new.keys()]
+    for k, v in new.items():
+        if k not in old:
+            opened.append((site, *k, *version(v)))
+        elif version(old[k]) != version(v):
+            closed.append((site, *k))
+            opened.append((site, *k, *version(v)))
+
+    where = " AND ".join(f"{c}=?" for c in ("SITE_DOMAIN",) + key)
+    if closed:
+        conn.executemany(
+            f"UPDATE adstxt_history SET REMOVED=datetime('now','utc') "
+            f"WHERE {where} AND REMOVED IS NULL",
+            closed,
+        )
+    if opened:
+        # a version removed and written again within the same second
+        # replaces its empty interval
+        conn.executemany(
+            f"INSERT OR REPLACE INTO adstxt_history "
+            f"({', '.join(('SITE_DOMAIN',) + key + HISTORY_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (1 + len(key) + len(HISTORY_COLUMNS)))})",
+            opened,
+        )
+
+
+# end write_history  #####
+
+#################################################################
+# CLASS SQLiteStorage
+#  everything in one SQLite DB, the default backend. The writer
+#  connection belongs to the thread calling write() and close().
+#
+#################################################################
+
+
+class SQLiteStorage:
+    def __init__(self, database, pragmas=()):
+        self.database = database
+        self.pragmas = tuple(pragmas)
+        self.conn = None
+        self.dropped = 0
+
+    def write(self, batch):
+        if self.conn is None:
+            self.conn = open_db(self.database, self.pragmas)
+
+        sql_rows = 0
+        try:
+            with self.conn:
+                for table, rows in batch.items():
+                    if table == "site":
+                        for site, rows_of_site, state in rows:
+                            sql_rows += write_site(self.conn, site, rows_of_site)
+                            if state is not None:
+                                self.conn.execute(INSERT_STMTS["crawl_state"], state)
+                    elif rows:
+                        self.conn.executemany(INSERT_STMTS[table], rows)
+        except sqlite3.Error as err:
+            rows = sum(len(rows) for rows in batch.values())
+            self.dropped += rows
+            logging.error(f"dropped batch of {rows} rows: {err}")
+            return 0
+
+        return sql_rows
+
+    def load_adsystem_ids(self):
+        select_stmt = "SELECT DOMAIN, MIN(ID) FROM adsystem_domain GROUP BY DOMAIN"
+        conn = sqlite3.connect(self.database, timeout=10)
+        try:
+            adsystem_ids = {domain: ads_id for domain, ads_id in conn.execute(select_stmt)}
+        finally:
+            conn.close()
+
+        return MappingProxyType(adsystem_ids)
+
+    def update_adsystem_domain(self):
+        update_stmt = """UPDATE ADSTXT
+                         SET ADSYSTEM_DOMAIN = (SELECT IFNULL(ID,0)
+                                                FROM ADSYSTEM_DOMAIN
+                                                WHERE ADSTXT.EXCHANGE_DOMAIN = ADSYSTEM_DOMAIN.DOMAIN)
+                         WHERE EXISTS (SELECT *
+                                       FROM ADSYSTEM_DOMAIN
+                                       WHERE ADSTXT.EXCHANGE_DOMAIN = ADSYSTEM_DOMAIN.DOMAIN);"""
+        conn = sqlite3.connect(self.database, timeout=10)
+        with conn:
+            conn.execute(update_stmt)
+        conn.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# end SQLiteStorage  #####
+
+#################################################################
+# CLASS PostgresStorage
+#  site content and adsystem_domain in PostgreSQL, bookkeeping rows
+#  (crawl_state, crawl_job...) in the 'state' SQLiteStorage. Every
+#  batch is COPYed into temporary staging tables and merged into the
+#  real ones in one transaction: the stored rows of the staged sites
+#  that are no longer listed are deleted, the others upserted only
+#  when a column changed. The bookkeeping rows are only committed
+#  after the content they describe.
+#  adsystem_domain is seeded from the SQLite DB of 'state'.
+#
+#################################################################
+
+
+class PostgresStorage:
+    def __init__(self, dsn, state):
+        global psycopg
+        if psycopg is None:
+            try:
+                import psycopg
+            except ImportError:
+                raise RuntimeError("PostgreSQL storage needs the psycopg package")
+        self.dsn = dsn
+        self.state = state
+        self.conn = None
+        self.dropped = 0
+
+        seed_conn = sqlite3.connect(state.database, timeout=10)
+        try:
+            adsystem_domains = seed_conn.execute(
+                "SELECT DOMAIN, ID FROM adsystem_domain WHERE DOMAIN IS NOT NULL AND ID IS NOT NULL"
+            ).fetchall()
+        finally:
+            seed_conn.close()
+
+        with psycopg.connect(dsn) as conn:
+            new_history = conn.execute("SELECT to_regclass('adstxt_history')").fetchone()[0] is None
+            for create_stmt in PG_SCHEMA:
+                conn.execute(create_stmt)
+            if new_history:
+                conn.execute(HISTORY_SEED)
+            conn.execute(
+                "CREATE TEMP TABLE stage_adsystem_domain (LIKE adsystem_domain) ON COMMIT DROP"
+            )
+            with conn.cursor().copy("COPY stage_adsystem_domain (DOMAIN, ID) FROM STDIN") as copy:
+                for row in adsystem_domains:
+                    copy.write_row(row)
+            conn.execute(
+                "INSERT INTO adsystem_domain SELECT * FROM stage_adsystem_domain ON CONFLICT DO NOTHING"
+            )
+
+    def open_writer(self):
+        self.conn = psycopg.connect(self.dsn)
+        self.conn.execute(
+            "CREATE TEMP TABLE stage_site (SITE_DOMAIN TEXT PRIMARY KEY) ON COMMIT DELETE ROWS"
+        )
+        for table, columns, key in SITE_TABLES.values():
+            self.conn.execute(
+                f"CREATE TEMP TABLE stage_{table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            )
+        self.conn.commit()
+
+    def write_sites(self, sites):
+        # a site crawled twice in the same batch keeps its last content
+        sites = {site: rows for site, rows, state in sites}
+        sql_rows = 0
+        with self.conn.transaction():
+            cur = self.conn.cursor()
+            with cur.copy("COPY stage_site (SITE_DOMAIN) FROM STDIN") as copy:
+                for site in sites:
+                    copy.write_row((site,))
+
+            staged = {table_key: [] for table_key in SITE_TABLES}
+            for site, rows in sites.items():
+                for table_key, new in site_rows(rows).items():
+                    staged[table_key].extend((site, *k, *v) for k, v in new.items())
+
+            for table_key, rows in staged.items():
+                table, columns, key = SITE_TABLES[table_key]
+                values = tuple(c for c in columns[1:] if c not in key)
+                ordered = ("SITE_DOMAIN",) + key + values
+                with cur.copy(f"COPY stage_{table} ({', '.join(ordered)}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+
+                if table_key == "adstxt":
+                    self.write_history(cur, key)
+                cur.execute(
+                    f"""DELETE FROM {table} t USING stage_site s
+                        WHERE t.SITE_DOMAIN = s.SITE_DOMAIN
+                        AND NOT EXISTS (SELECT 1 FROM stage_{table} n
+                                        WHERE {' AND '.join(f'n.{c} = t.{c}' for c in ('SITE_DOMAIN',) + key)})"""
+                )
+                sql_rows += cur.rowcount
+                cur.execute(
+                    f"""INSERT INTO {table} ({', '.join(ordered)})
+                        SELECT {', '.join(ordered)} FROM stage_{table}
+                        ON CONFLICT ({', '.join(('SITE_DOMAIN',) + key)}) DO UPDATE
+                        SET {', '.join(f'{c} = EXCLUDED.{c}' for c in values)}, UPDATED = DEFAULT
+                        WHERE ({', '.join(f'{table}.{c}' for c in values)})
+                              IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in values)})"""
+                )
+                sql_rows += cur.rowcount
+
+        return sql_rows
+
+    # the write_history of write_sites: close the open intervals of
+    # the staged sites that no staged row matches, then open one for
+    # every staged row without an open interval
+    def write_history(self, cur, key):
+        primary_key = ("SITE_DOMAIN",) + key
+        match = " AND ".join(f"n.{c} = h.{c}" for c in primary_key)
+        cur.execute(
+            f"""UPDATE adstxt_history h SET REMOVED = now() at time zone 'utc'
+                FROM stage_site s
+                WHERE h.SITE_DOMAIN = s.SITE_DOMAIN AND h.REMOVED IS NULL
+                AND NOT EXISTS (SELECT 1 FROM stage_adstxt n WHERE {match}
+                                {''.join(f' AND n.{c} = h.{c}' for c in HISTORY_COLUMNS)})"""
+        )
+        cur.execute(
+            f"""INSERT INTO adstxt_history ({', '.join(primary_key + HISTORY_COLUMNS)})
+                SELECT {', '.join(f'n.{c}' for c in primary_key + HISTORY_COLUMNS)}
+                FROM stage_adstxt n
+                WHERE NOT EXISTS (SELECT 1 FROM adstxt_history h
+                                  WHERE {match} AND h.REMOVED IS NULL)
+                ON CONFLICT ({', '.join(primary_key)}, FIRST_SEEN) DO UPDATE
+                SET {', '.join(f'{c} = EXCLUDED.{c}' for c in HISTORY_COLUMNS)}, REMOVED = NULL"""
+        )
+
+    def write(self, batch):
+        sites = batch.get("site")
+        sql_rows = 0
+        if sites:
+            try:
+                if self.conn is None or self.conn.closed:
+                    self.open_writer()
+                sql_rows = self.write_sites(sites)
+            except psycopg.Error as err:
+                rows = sum(len(rows) for rows in batch.values())
+                self.dropped += rows
+                logging.error(f"dropped batch of {rows} rows: {err}")
+                return 0
+
+        # the crawl_state rows of the sites only once their content is in
+        state = {table: rows for table, rows in batch.items() if table != "site"}
+        if sites:
+            state["crawl_state"] = state.get("crawl_state", []) + [
+                row for site, rows, row in sites if row is not None
+            ]
+        dropped = self.state.dropped
+        self.state.write(state)
+        self.dropped += self.state.dropped - dropped
+        return sql_rows
+
+    def load_adsystem_ids(self):
+        select_stmt = "SELECT DOMAIN, MIN(ID) FROM adsystem_domain GROUP BY DOMAIN"
+        with psycopg.connect(self.dsn) as conn:
+            adsystem_ids = {domain: ads_id for domain, ads_id in conn.execute(select_stmt)}
+
+        return MappingProxyType(adsystem_ids)
+
+    def update_adsystem_domain(self):
+        update_stmt = """UPDATE adstxt SET ADSYSTEM_DOMAIN = d.ID
+                         FROM (SELECT DOMAIN, MIN(ID) AS ID FROM adsystem_domain GROUP BY DOMAIN) d
+                         WHERE adstxt.EXCHANGE_DOMAIN = d.DOMAIN AND adstxt.ADSYSTEM_DOMAIN <> d.ID"""
+        with psycopg.connect(self.dsn) as conn:
+            conn.execute(update_stmt)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.state.close()
+
+
+# end PostgresStorage  #####
+
+#################################################################
+# FUNCTION open_storage
+#  the backend for a --storage URL: None for the SQLite DB
+#  'database' itself, or a postgresql:// URL
+#
+#################################################################
+
+
+def open_storage(url, database, pragmas=()):
+    state = SQLiteStorage(database, pragmas)
+    if not url:
+        return state
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresStorage(url, state)
+
+    raise ValueError(f"unsupported storage {url}")
+
+
+# end open_storage  #####
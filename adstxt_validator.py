@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+########################################################################################################
+# See README.md file
+#
+# Batch validator used by adstxt_crawler.py. It takes all the records adstxt_parser.py produced for one
+# ads.txt file and returns the rows to store plus the reasons why the other records were rejected. Every
+# field is normalized once and checked against precompiled patterns and frozen sets; like the parser it
+# does no network, disk or DB access.
+#
+#   >>> validate_records("blue.example.com", parse_adstxt(b"green_ssp.com, 70922, DIRECT\nx.com,1,OWNER\n"),
+#   ...                  {"green_ssp.com": 1001})
+#   Validated(rows=[('adstxt', ('blue.example.com', 'green_ssp.com', 1001, '70922', 'direct', '', ''))],
+#             referrals=[], rejections=[Rejection(line_number=2, reason='unknown adsystem', value='x.com')])
+#
+########################################################################################################
+
+import re
+from collections import namedtuple
+from adstxt_parser import DataRecord, VariableRecord, ErrorRecord
+
+# rejection reasons
+SHORT_DOMAIN = "short domain"
+BAD_DOMAIN = "bad domain"
+UNKNOWN_ADSYSTEM = "unknown adsystem"
+MISSING_ACCOUNT_ID = "missing account id"
+BAD_ACCOUNT_TYPE = "bad account type"
+
+# ads.txt supports 'DIRECT' and 'RESELLER'
+ACCOUNT_TYPES = frozenset(("direct", "reseller"))
+
+# lowercase domain name, a minimum of 3 characters is checked apart
+DOMAIN_PATTERN = re.compile(r"^[a-z0-9_](?:[a-z0-9_.-]*[a-z0-9_])?(?::[0-9]{1,5})?$")
+
+# content directives and the table key of the rows they produce
+DIRECTIVES = {
+    "subdomain": None,
+    "contentproducerdomain": "cd",
+    "contentdistributordomain": "cp",
+}
+
+# one rejected record, 'value' is the offending field
+Rejection = namedtuple("Rejection", "line_number reason value")
+
+# outcome of validate_records: 'rows' are (table key, bind values)
+# pairs for the DB writer, 'referrals' the hosts named by directives
+Validated = namedtuple("Validated", "rows referrals rejections")
+
+#################################################################
+# FUNCTION domain_error
+#  why a lowercase domain is not acceptable, or None
+#
+#################################################################
+
+
+def domain_error(domain):
+    # Minimum length of a domain name is 1 character, not including extensions.
+    # Domain Name Rules - Nic AG
+    # www.nic.ag/rules.htm
+    if len(domain) < 3:
+        return SHORT_DOMAIN
+    if not DOMAIN_PATTERN.match(domain):
+        return BAD_DOMAIN
+
+    return None
+
+
+# end domain_error  #####
+
+#################################################################
+# FUNCTION validate_records
+#  validate the records of the ads.txt file of 'site' in one pass.
+#  'adsystem_ids' maps lowercase exchange domains to their ID, a data
+#  record of any other exchange is rejected.
+#  returns a Validated tuple
+#
+#################################################################
+
+
+def validate_records(site, records, adsystem_ids):
+    rows = []
+    referrals = []
+    rejections = []
+
+    site = site.lower().strip()
+    site_error = domain_error(site)
+
+    for record in records:
+        if isinstance(record, DataRecord):
+            exchange_domain = record.exchange_domain.lower()
+            seller_account_id = record.seller_account_id.lower()
+            account_type = record.account_type.lower()
+            adsystem_id = adsystem_ids.get(exchange_domain)
+            exchange_error = domain_error(exchange_domain)
+
+            if site_error:
+                rejections.append(Rejection(record.line_number, site_error, site))
+            elif exchange_error:
+                rejections.append(
+                    Rejection(record.line_number, exchange_error, exchange_domain)
+                )
+            elif not isinstance(adsystem_id, int):
+                rejections.append(
+                    Rejection(record.line_number, UNKNOWN_ADSYSTEM, exchange_domain)
+                )
+            # could be single digit integers
+            elif not seller_account_id:
+                rejections.append(
+                    Rejection(record.line_number, MISSING_ACCOUNT_ID, seller_account_id)
+                )
+            elif account_type not in ACCOUNT_TYPES:
+                rejections.append(Rejection(record.line_number, BAD_ACCOUNT_TYPE, account_type))
+            else:
+                rows.append(
+                    (
+                        "adstxt",
+                        (
+                            site,
+                            exchange_domain,
+                            adsystem_id,
+                            seller_account_id,
+                            account_type,
+                            record.tag_id.lower(),
+                            record.comment,
+                        ),
+                    )
+                )
+
+        elif isinstance(record, VariableRecord):
+            directive = next((d for d in DIRECTIVES if record.name.startswith(d)), None)
+            if directive is None:
+                continue
+            rhs_host = record.value.lower()
+            referrals.append(rhs_host)
+
+            table_key = DIRECTIVES[directive]
+            if table_key is None:
+                continue
+            error = site_error or domain_error(rhs_host)
+            if error:
+                rejections.append(
+                    Rejection(record.line_number, error, site if site_error else rhs_host)
+                )
+            else:
+                rows.append((table_key, (site, rhs_host, record.comment)))
+
+        elif isinstance(record, ErrorRecord):
+            rejections.append(Rejection(record.line_number, record.reason, record.line))
+
+    return Validated(rows, referrals, rejections)
+
+
+# end validate_records  #####
@@ -0,0 +1,21 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# an empty crawler DB created from adstxt_crawler.sql
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "adstxt.db")
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "adstxt_crawler.sql"), encoding="utf-8") as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO adsystem_domain (DOMAIN, ID) VALUES ('green_ssp.com', 1)")
+    conn.commit()
+    conn.close()
+    return path
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from adstxt_crawler import Crawler, crawl_async, load_raw_response
+
+
+# serves the ads.txt of the loopback address a request came in on:
+# 127.0.0.1 refers to 127.0.0.2, which refers to 127.0.0.3
+class ChainHandler(BaseHTTPRequestHandler):
+    delays = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        ip = self.connection.getsockname()[0]
+        time.sleep(self.delays.get(ip, 0.0))
+        port = self.server.server_address[1]
+        index = int(ip.rsplit(".", 1)[1])
+        lines = [f"green_ssp.com, {index}, DIRECT"]
+        if index < 3:
+            lines.append(f"subdomain=127.0.0.{index + 1}:{port}")
+        body = ("\n".join(lines) + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# serves a file in another charset than UTF-8
+class Utf16Handler(BaseHTTPRequestHandler):
+    body = "green_ssp.com, 1234, DIRECT\n".encode("utf-16")
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-16")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(("0.0.0.0", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def chain_server():
+    server = serve(ChainHandler)
+    yield server
+    server.shutdown()
+    server.server_close()
+    ChainHandler.delays = {}
+
+
+@pytest.fixture
+def utf16_server():
+    server = serve(Utf16Handler)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def crawl_chain(database, port, target_delay):
+    # 127.0.0.2 is listed as a target too, after 127.0.0.1 has referred to it
+    async def targets():
+        yield f"127.0.0.1:{port}"
+        await asyncio.sleep(target_delay)
+        yield f"127.0.0.2:{port}"
+
+    asyncio.run(
+        crawl_async(
+            targets(), database, concurrency=4, retries=0, progress_interval=0, max_depth=1
+        )
+    )
+    conn = sqlite3.connect(database)
+    try:
+        return {row[0] for row in conn.execute("SELECT SITE_DOMAIN FROM adstxt")}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize(
+    "delays, target_delay",
+    [
+        # the target line comes while the referral is still in flight
+        ({"127.0.0.2": 1.0}, 0.3),
+        # the target line comes after the referral was processed at max depth
+        ({}, 1.0),
+    ],
+)
+def test_target_also_referred_follows_its_referrals(
+    database, chain_server, delays, target_delay
+):
+    ChainHandler.delays = delays
+    port = chain_server.server_address[1]
+    sites = crawl_chain(database, port, target_delay)
+    assert sites == {f"127.0.0.{i}:{port}" for i in (1, 2, 3)}
+
+
+def test_replay_reparses_the_bytes_served(database, utf16_server, tmp_path):
+    raw_store = str(tmp_path / "raw")
+    crawler = Crawler(database, raw_store=raw_store, retries=0, progress_interval=0)
+    crawler.crawl([f"127.0.0.1:{utf16_server.server_address[1]}"])
+
+    conn = sqlite3.connect(database)
+    try:
+        content_hash, charset = conn.execute(
+            "SELECT CONTENT_HASH, CHARSET FROM raw_response"
+        ).fetchone()
+        assert content_hash == hashlib.sha1(Utf16Handler.body).hexdigest()
+        assert charset == "utf-16"
+        assert load_raw_response(raw_store, content_hash) == Utf16Handler.body
+        crawled = conn.execute("SELECT * FROM adstxt").fetchall()
+        assert [row[3] for row in crawled] == ["1234"]
+        conn.execute("DELETE FROM adstxt")
+        conn.commit()
+
+        crawler.replay()
+        assert conn.execute("SELECT * FROM adstxt").fetchall() == crawled
+    finally:
+        conn.close()
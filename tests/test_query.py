@@ -0,0 +1,46 @@
+import sqlite3
+
+from adstxt_query import BATCH_KEYS, lookup_account_types, lookup_stmt
+
+ROWS = [
+    ("blue.example.com", "green_ssp.com", 1, "70922", "direct", "", ""),
+    ("blue.example.com", "green_ssp.com", 1, "70923", "reseller", "", ""),
+    ("red.example.com", "green_ssp.com", 1, "70922", "reseller", "", ""),
+]
+
+
+def open_adstxt(database):
+    conn = sqlite3.connect(database)
+    conn.executemany(
+        "INSERT INTO adstxt (SITE_DOMAIN, EXCHANGE_DOMAIN, ADSYSTEM_DOMAIN, SELLER_ACCOUNT_ID, "
+        "ACCOUNT_TYPE, TAG_ID, ENTRY_COMMENT) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ROWS,
+    )
+    conn.commit()
+    return conn
+
+
+def test_lookup_stmt_seeks_the_primary_key(database):
+    conn = open_adstxt(database)
+    for num_keys in (1, BATCH_KEYS):
+        plan = [
+            row[3]
+            for row in conn.execute(
+                "EXPLAIN QUERY PLAN " + lookup_stmt(num_keys), ["x"] * (3 * num_keys)
+            )
+        ]
+        adstxt_steps = [step for step in plan if step.split()[1] == "a"]
+        assert adstxt_steps, plan
+        for step in adstxt_steps:
+            assert step.startswith("SEARCH a USING"), plan
+            assert "SITE_DOMAIN=? AND EXCHANGE_DOMAIN=? AND SELLER_ACCOUNT_ID=?" in step
+
+
+def test_lookup_account_types(database):
+    conn = open_adstxt(database)
+    keys = [
+        ("Blue.Example.com", "green_ssp.com", "70923"),
+        ("red.example.com", "green_ssp.com", "70922"),
+        ("red.example.com", "green_ssp.com", "70923"),
+    ] * BATCH_KEYS
+    assert lookup_account_types(conn, keys) == ["reseller", "reseller", None] * BATCH_KEYS
@@ -0,0 +1,47 @@
+import pytest
+
+from adstxt_crawler import (
+    Crawler,
+    clear_shard_marker,
+    read_shard_markers,
+    write_shard_marker,
+)
+
+STATS = {"hosts": 1, "processed": 1, "records": 1}
+
+
+def test_merge_refuses_empty_shard_dir(database, tmp_path):
+    shard_dir = tmp_path / "shards"
+    shard_dir.mkdir()
+    with pytest.raises(ValueError, match="No shard markers"):
+        Crawler(database).merge([str(shard_dir)])
+    with pytest.raises(ValueError, match="No shard markers of run 'day1'"):
+        read_shard_markers(str(shard_dir), "day1")
+
+
+def test_merge_refuses_cleared_run(database, tmp_path):
+    shard_dir = str(tmp_path / "shards")
+    write_shard_marker(shard_dir, 0, 1, database, STATS, run_id="day1")
+    assert [m["run_id"] for m in read_shard_markers(shard_dir, "day1")[0]] == ["day1"]
+
+    # the shard of the next run has started but not finished
+    clear_shard_marker(shard_dir, 0, 1)
+    with pytest.raises(ValueError, match="No shard markers"):
+        Crawler(database).merge([shard_dir], run_id="day2")
+
+
+def test_read_shard_markers_mixed_runs_and_counts(database, tmp_path):
+    shard_dir = str(tmp_path / "shards")
+    write_shard_marker(shard_dir, 0, 2, database, STATS, run_id="day1")
+    assert read_shard_markers(shard_dir, "day1")[1] == ["1/2"]
+
+    write_shard_marker(shard_dir, 1, 2, database, STATS, run_id="day2")
+    with pytest.raises(ValueError, match="runs"):
+        read_shard_markers(shard_dir)
+    with pytest.raises(ValueError, match="another run"):
+        read_shard_markers(shard_dir, "day2")
+
+    write_shard_marker(shard_dir, 1, 2, database, STATS, run_id="day1")
+    write_shard_marker(shard_dir, 0, 3, database, STATS, run_id="day1")
+    with pytest.raises(ValueError, match="shard counts"):
+        read_shard_markers(shard_dir, "day1")